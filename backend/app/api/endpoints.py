@@ -2,152 +2,283 @@
 API endpoints for BeatCanvas music generation.
 """
 
-import os
-import uuid
+import asyncio
+import logging
+import tempfile
 import time
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from typing import AsyncIterator, Dict, Optional, Set, Union
+from urllib.parse import quote
+import numpy as np
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from app.models import GenerateRequest
 from app.services.openai_service import OpenAIService
 from app.services.midi_service import MidiService
 from app.services.audio_service import AudioService
+from app.services.cache_service import audio_cache, semantic_index
+from app.services.cleanup_service import CleanupService, remove_files
 from app.config import settings
 
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+# Shared service instances (reuse the OpenAI connection pool across requests)
+openai_service = OpenAIService()
+midi_service = MidiService()
+audio_service = AudioService()
+cleanup_service = CleanupService()
+
+# Slowest tempo the composition may use (MetadataSchema lower bound)
+MIN_TEMPO = 60
+
+# Strong references to fire-and-forget tasks (the event loop only keeps weak ones)
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _content_disposition(filename: str) -> str:
+    """Build an attachment Content-Disposition header (same format as FileResponse)."""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _store_in_cache(mp3_path: str, cache_key: str, midi_key: str, headers: Dict[str, str]) -> None:
+    """Store a finished MP3 under its MIDI hash and link the request key (blocking)."""
+    audio_cache.store(midi_key, mp3_path, headers)
+    audio_cache.link(cache_key, midi_key, headers)
+
+
+async def _index_request(request: GenerateRequest, cache_key: str, embedding: Optional[np.ndarray]) -> None:
+    """Register a cached result in the semantic index, embedding the request if not done yet."""
+    if embedding is None:
+        try:
+            embedding = await openai_service.embed_request(
+                genre=request.genre,
+                mood=request.mood,
+                tempo=request.tempo,
+                bars=request.bars
+            )
+        except Exception as e:
+            logger.warning("Semantic indexing skipped: %s", e)
+            return
+    semantic_index.add(embedding, request.bars, request.tempo, cache_key)
+
+
+async def _stream_and_cache(
+    chunks: AsyncIterator[bytes],
+    cache_key: str,
+    midi_key: str,
+    headers: Dict[str, str],
+    request: GenerateRequest,
+    embedding: Optional[np.ndarray],
+    index: bool
+) -> AsyncIterator[bytes]:
+    """
+    Yield MP3 chunks to the client while writing them to a temp file.
+
+    Once the stream completes, the file is stored in the MP3 cache under the
+    MIDI content hash, linked under the request key, and (if index is set)
+    registered in the semantic index in a background task. If the stream fails or the client
+    disconnects, the partial file is discarded.
+    """
+    # Written inside the cache directory so storing it is a rename, not a copy
+    # (the .part suffix keeps eviction from counting it while it is written)
+    mp3_file = tempfile.NamedTemporaryFile(
+        suffix=audio_cache.PARTIAL_SUFFIX, dir=audio_cache.cache_dir, delete=False
+    )
+    completed = False
+    try:
+        async for chunk in chunks:
+            mp3_file.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        mp3_file.close()
+        if completed:
+            try:
+                # Off the event loop: the move, sidecar writes and any eviction scan block
+                await asyncio.to_thread(_store_in_cache, mp3_file.name, cache_key, midi_key, headers)
+            except OSError:
+                completed = False
+        if not completed:
+            # Removed right away rather than queued: the cleanup worker's batch
+            # would be lost if the process exits before its next sweep
+            remove_files([mp3_file.name])
+        elif index:
+            # Embedding may take a round trip; don't hold the response open for it
+            task = asyncio.create_task(_index_request(request, cache_key, embedding))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
 
-@router.post("/generate")
+@router.post("/generate", response_model=None)
 async def generate_music(
     request: GenerateRequest,
-    background_tasks: BackgroundTasks
-) -> FileResponse:
+    no_cache: bool = Query(False, description="Bypass cached results and force regeneration")
+) -> Union[FileResponse, StreamingResponse]:
     """
     Generate music from genre/mood input.
 
     Flow:
-    1. Validate input (Pydantic)
+    1. Validate input (Pydantic), return cached MP3 if available
     2. Generate music JSON with OpenAI
     3. Convert JSON → MIDI
-    4. Convert MIDI → WAV
-    5. Convert WAV → MP3
-    6. Return MP3 file
-    7. Cleanup temp files in background
+    4. Render MIDI → PCM in memory
+    5. Stream MP3 (LAME, in-process) to the client, storing it in the cache
+    6. Queue temp files for deletion by the cleanup worker
 
     Args:
         request: GenerateRequest with genre, mood, tempo (optional), bars
-        background_tasks: FastAPI background tasks for cleanup
+        no_cache: Skip cached compositions and call OpenAI again
 
     Returns:
-        FileResponse with MP3 audio file
+        FileResponse for cached MP3s, otherwise StreamingResponse of the MP3
 
     Raises:
         HTTPException: On any error during generation
     """
-    # Generate unique ID for this request
-    request_id = str(uuid.uuid4())
+    filename = f"beatcanvas_{request.genre}_{request.mood}_{request.bars}bars.mp3"
 
-    # Ensure temp directory exists
-    os.makedirs(settings.TEMP_DIR, exist_ok=True)
+    # Serve identical requests straight from the MP3 cache
+    cache_key = audio_cache.make_key(request.model_dump())
+    embedding = None
+    if not no_cache:
+        cached = audio_cache.lookup(cache_key)
+        if cached is not None:
+            logger.info("MP3 cache hit %s", cache_key[:12])
 
-    # Define file paths
-    midi_path = os.path.join(settings.TEMP_DIR, f"{request_id}.mid")
-    wav_path = os.path.join(settings.TEMP_DIR, f"{request_id}.wav")
-    mp3_path = os.path.join(settings.TEMP_DIR, f"{request_id}.mp3")
+        # Fall back to near-duplicate requests (e.g. "EDM/Energetic" vs "edm / energetic");
+        # only worth an embedding call if a past request can match (otherwise the
+        # request is embedded after its MP3 has been streamed)
+        if cached is None and semantic_index.has_entries(request.bars, request.tempo):
+            try:
+                embedding = await openai_service.embed_request(
+                    genre=request.genre,
+                    mood=request.mood,
+                    tempo=request.tempo,
+                    bars=request.bars
+                )
+            except Exception as e:
+                logger.warning("Embedding lookup skipped: %s", e)
+            else:
+                similar_key = semantic_index.search(embedding, request.bars, request.tempo)
+                if similar_key is not None:
+                    cached = audio_cache.lookup(similar_key)
+                    if cached is not None:
+                        logger.info("Semantic cache hit %s", similar_key[:12])
+
+        if cached is not None:
+            cached_path, cached_headers = cached
+            return FileResponse(
+                path=cached_path,
+                media_type="audio/mpeg",
+                filename=filename,
+                headers=cached_headers
+            )
+
+    # Create a uniquely named temp file for this request
+    with tempfile.NamedTemporaryFile(suffix=".mid", dir=settings.TEMP_DIR, delete=False) as midi_file:
+        midi_path = midi_file.name
 
     try:
         total_start = time.time()
 
         # Step 1: Generate music JSON with OpenAI
-        print(f"\n=== GENERATE REQUEST ===")
-        print(f"Genre: {request.genre}")
-        print(f"Mood: {request.mood}")
-        print(f"Tempo: {request.tempo}")
-        print(f"Bars: {request.bars}")
-        print(f"========================\n")
+        logger.debug(
+            "generate request genre=%s mood=%s tempo=%s bars=%s",
+            request.genre, request.mood, request.tempo, request.bars
+        )
+
+        # Warm up the synthesizer while waiting on OpenAI (no data dependency);
+        # the render buffer is sized for the longest loop this request allows
+        max_seconds = request.bars * 4 * 60.0 / (request.tempo or MIN_TEMPO)
 
         step1_start = time.time()
-        openai_service = OpenAIService()
-        music_data = await openai_service.generate_music_json(
-            genre=request.genre,
-            mood=request.mood,
-            tempo=request.tempo,
-            bars=request.bars
+        # Warm-up is best-effort, so only the OpenAI result can fail the request
+        music_data, _ = await asyncio.gather(
+            openai_service.generate_music_json(
+                genre=request.genre,
+                mood=request.mood,
+                tempo=request.tempo,
+                bars=request.bars,
+                use_cache=not no_cache
+            ),
+            audio_service.warm_up(max_seconds),
+            return_exceptions=True
         )
+        if isinstance(music_data, BaseException):
+            raise music_data
         step1_time = time.time() - step1_start
 
-        print(f"\n=== GENERATED MUSIC DATA ===")
-        print(f"Tempo: {music_data.metadata.tempo}")
-        print(f"Bars: {music_data.metadata.bars}")
-        print(f"Key: {music_data.metadata.key} {music_data.metadata.scale}")
-        print(f"Tracks: {len(music_data.tracks)}")
-        for track in music_data.tracks:
-            max_time = max((note.start_time + note.duration for note in track.notes), default=0)
-            print(f"  - {track.name}: {len(track.notes)} notes, max_time: {max_time:.2f} quarter notes")
-        print(f"============================\n")
+        # Per-track scan walks every note, so only run it when it will be logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "generated tempo=%s bars=%s key=%s %s tracks=%d",
+                music_data.metadata.tempo, music_data.metadata.bars,
+                music_data.metadata.key, music_data.metadata.scale, len(music_data.tracks)
+            )
+            for track in music_data.tracks:
+                max_time = max((note.start_time + note.duration for note in track.notes), default=0)
+                logger.debug("  %s: %d notes, max_time: %.2f quarter notes", track.name, len(track.notes), max_time)
 
         # Step 2: JSON → MIDI
         step2_start = time.time()
-        midi_service = MidiService()
         midi_service.convert_json_to_midi(music_data, midi_path)
         step2_time = time.time() - step2_start
 
-        # Step 3: MIDI → WAV
+        headers = {
+            "X-Tempo": str(music_data.metadata.tempo),
+            "X-Bars": str(music_data.metadata.bars),
+            "X-Key": music_data.metadata.key,
+            "X-Scale": music_data.metadata.scale
+        }
+
+        # Different compositions can produce identical MIDI; reuse its MP3 if rendered before
+        midi_key = audio_cache.make_file_key(midi_path)
+        cached = audio_cache.lookup(midi_key)
+        if cached is not None:
+            cleanup_service.schedule(midi_path)
+            logger.info("MIDI cache hit %s", midi_key[:12])
+            await asyncio.to_thread(audio_cache.link, cache_key, midi_key, headers)
+            return FileResponse(
+                path=cached[0],
+                media_type="audio/mpeg",
+                filename=filename,
+                headers=headers
+            )
+
+        # Step 3: MIDI → PCM
         step3_start = time.time()
-        audio_service = AudioService()
-        audio_service.midi_to_wav(midi_path, wav_path)
+        pcm = await audio_service.render_pcm(midi_path)
         step3_time = time.time() - step3_start
 
-        # Step 4: WAV → MP3
-        step4_start = time.time()
-        audio_service.wav_to_mp3(wav_path, mp3_path)
-        step4_time = time.time() - step4_start
+        # MIDI is no longer needed; queue it for the cleanup worker
+        cleanup_service.schedule(midi_path)
+
+        # Step 4: Set up the MP3 encoder (output is streamed as it is produced)
+        mp3_stream = audio_service.encode_mp3_stream(pcm)
 
         total_time = time.time() - total_start
 
-        # Print timing breakdown
-        print(f"\n=== PERFORMANCE BREAKDOWN ===")
-        print(f"Step 1 (OpenAI API):  {step1_time:.2f}s ({step1_time/total_time*100:.1f}%)")
-        print(f"Step 2 (JSON→MIDI):   {step2_time:.2f}s ({step2_time/total_time*100:.1f}%)")
-        print(f"Step 3 (MIDI→WAV):    {step3_time:.2f}s ({step3_time/total_time*100:.1f}%) ← BOTTLENECK?")
-        print(f"Step 4 (WAV→MP3):     {step4_time:.2f}s ({step4_time/total_time*100:.1f}%)")
-        print(f"TOTAL TIME:           {total_time:.2f}s")
-        print(f"============================\n")
-
-        # Step 5: Schedule cleanup in background
-        def cleanup():
-            """Delete temporary files after response is sent."""
-            for path in [midi_path, wav_path, mp3_path]:
-                if os.path.exists(path):
-                    try:
-                        os.remove(path)
-                    except Exception:
-                        pass  # Silent failure for cleanup
-
-        background_tasks.add_task(cleanup)
-
-        # Step 6: Return MP3 file
-        filename = f"beatcanvas_{request.genre}_{request.mood}_{request.bars}bars.mp3"
-        return FileResponse(
-            path=mp3_path,
+        # Log timing breakdown (MP3 encoding overlaps with the response)
+        logger.debug(
+            "timings openai=%.2fs json_to_midi=%.2fs midi_to_pcm=%.2fs time_to_first_byte=%.2fs",
+            step1_time, step2_time, step3_time, total_time
+        )
+
+        # Step 5: Stream MP3, storing it in the cache once complete
+        return StreamingResponse(
+            _stream_and_cache(mp3_stream, cache_key, midi_key, headers, request, embedding, index=not no_cache),
             media_type="audio/mpeg",
-            filename=filename,
-            headers={
-                "X-Tempo": str(music_data.metadata.tempo),
-                "X-Bars": str(music_data.metadata.bars),
-                "X-Key": music_data.metadata.key,
-                "X-Scale": music_data.metadata.scale
-            }
+            headers={**headers, "Content-Disposition": _content_disposition(filename)}
         )
 
     except Exception as e:
         # Cleanup on error
-        for path in [midi_path, wav_path, mp3_path]:
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                except Exception:
-                    pass
+        cleanup_service.schedule(midi_path)
 
         # Determine appropriate error code
         error_message = str(e)
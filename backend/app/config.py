@@ -3,15 +3,33 @@ Configuration settings for BeatCanvas backend.
 Loads environment variables from .env file.
 """
 
+import os
+import tempfile
 from pydantic_settings import BaseSettings
 
 
+def _default_temp_dir() -> str:
+    """
+    Default location for per-request MIDI/MP3 files.
+
+    Prefers the RAM-backed /dev/shm on Linux so intermediate files never
+    touch the disk, falling back to the system temp directory elsewhere.
+    """
+    if os.path.isdir("/dev/shm"):
+        return "/dev/shm/beatcanvas"
+    return os.path.join(tempfile.gettempdir(), "beatcanvas")
+
+
 class Settings(BaseSettings):
     """Application settings loaded from environment variables."""
 
     OPENAI_API_KEY: str
     SOUNDFONT_PATH: str = "../soundfonts/GeneralUserGS.sf2"
-    TEMP_DIR: str = "./temp"
+    TEMP_DIR: str = _default_temp_dir()
+    CACHE_DIR: str = "./temp/cache"
+    CACHE_MAX_BYTES: int = 2 * 1024 ** 3  # 2 GB of cached MP3 files
+    LOG_LEVEL: str = "INFO"
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92  # Cosine similarity for near-duplicate requests
 
     class Config:
         env_file = ".env"
@@ -3,9 +3,44 @@ BeatCanvas FastAPI Application
 Main entry point for the backend API.
 """
 
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.endpoints import router
+from app.api.endpoints import router, audio_service, cleanup_service, openai_service
+from app.services.cache_service import audio_cache
+from app.config import settings
+
+
+logging.basicConfig(level=settings.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Application startup/shutdown hooks.
+
+    On startup, creates the temp/cache directories, deletes partially
+    written MP3s, trims the MP3 cache back under its size limit, verifies the SoundFont exists, and starts
+    the temp file cleanup worker. The SoundFont itself is loaded into the
+    shared synthesizer in the background so the server starts accepting
+    requests immediately; /generate waits for it alongside the OpenAI call.
+    On shutdown, flushes pending deletions, releases the synthesizer and
+    closes the OpenAI connection pool.
+    """
+    os.makedirs(settings.TEMP_DIR, exist_ok=True)
+    os.makedirs(settings.CACHE_DIR, exist_ok=True)
+    audio_cache.remove_partial()
+    audio_cache.evict()
+    audio_service.verify_soundfont()
+    warm_up = asyncio.create_task(audio_service.warm_up())
+    cleanup_service.start()
+    yield
+    await cleanup_service.stop()
+    await asyncio.gather(warm_up, return_exceptions=True)
+    audio_service.close()
+    await openai_service.close()
 
 
 # Create FastAPI application
@@ -14,7 +49,8 @@ app = FastAPI(
     description="AI-powered music generation API using OpenAI and Python audio processing",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Configure CORS for local development
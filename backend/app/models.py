@@ -3,7 +3,7 @@ Pydantic models for request/response validation and music data structures.
 """
 
 from typing import List, Literal, Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 # ===== Request/Response Models =====
@@ -16,8 +16,8 @@ class GenerateRequest(BaseModel):
     tempo: Optional[int] = Field(None, ge=60, le=180, description="BPM (60-180), AI selects if not provided")
     bars: int = Field(default=8, ge=4, le=16, description="Number of bars (4, 8, or 16)")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "genre": "EDM",
                 "mood": "Energetic",
@@ -25,6 +25,7 @@ class GenerateRequest(BaseModel):
                 "bars": 8
             }
         }
+    )
 
 
 # ===== Music JSON Schema Models =====
@@ -37,8 +38,8 @@ class NoteSchema(BaseModel):
     duration: float = Field(..., gt=0, le=16, description="Duration in quarter notes")
     velocity: int = Field(..., ge=0, le=127, description="Note velocity/volume (0-127)")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "pitch": 60,
                 "start_time": 0.0,
@@ -46,6 +47,7 @@ class NoteSchema(BaseModel):
                 "velocity": 100
             }
         }
+    )
 
 
 class TrackSchema(BaseModel):
@@ -56,8 +58,8 @@ class TrackSchema(BaseModel):
     midi_program: int = Field(..., ge=0, le=127, description="MIDI program number (0-127)")
     notes: List[NoteSchema] = Field(..., description="List of notes in this track")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "name": "drums",
                 "instrument": "drums",
@@ -72,6 +74,7 @@ class TrackSchema(BaseModel):
                 ]
             }
         }
+    )
 
 
 class MetadataSchema(BaseModel):
@@ -83,8 +86,8 @@ class MetadataSchema(BaseModel):
     key: str = Field(..., pattern="^[A-G](#|b)?$", description="Root key (C, D, E, F, G, A, B, with optional # or b)")
     scale: Literal["major", "minor"] = Field(..., description="Scale type")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "tempo": 120,
                 "bars": 8,
@@ -93,6 +96,7 @@ class MetadataSchema(BaseModel):
                 "scale": "major"
             }
         }
+    )
 
 
 class MusicSchema(BaseModel):
@@ -101,8 +105,8 @@ class MusicSchema(BaseModel):
     metadata: MetadataSchema = Field(..., description="Composition metadata")
     tracks: List[TrackSchema] = Field(..., min_length=1, description="List of instrument tracks")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "metadata": {
                     "tempo": 120,
@@ -128,3 +132,4 @@ class MusicSchema(BaseModel):
                 ]
             }
         }
+    )
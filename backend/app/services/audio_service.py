@@ -1,151 +1,395 @@
 """
-Audio Service: Handles MIDI → WAV → MP3 conversion pipeline.
+Audio Service: Handles MIDI → MP3 conversion pipeline.
 """
 
-import subprocess
+import asyncio
+import io
+import logging
 import os
-from pydub import AudioSegment
+import threading
+from collections import deque
+from typing import AsyncIterator, Union
+import fluidsynth
+import lameenc
+import mido
+import numpy as np
 from app.config import settings
 
 
+logger = logging.getLogger(__name__)
+
+
+# Rendering settings
+SAMPLE_RATE = 22050         # 22.05kHz - 2x faster than 44.1kHz
+TAIL_SECONDS = 1.0          # Release time rendered after the last event
+MIDI_CHANNELS = 16
+DRUM_CHANNEL = 9            # General MIDI percussion channel (10, zero-based)
+DRUM_BANK = 128             # SoundFont percussion bank
+POLYPHONY = 64              # Max voices (default 256); plenty for 3-5 track loops
+MAX_POOLED_BUFFERS = 4      # Render buffers kept for reuse
+
+
 class AudioService:
-    """Service for converting MIDI to audio formats (WAV and MP3)."""
+    """Service for converting MIDI to MP3 audio."""
 
-    def midi_to_wav(self, midi_path: str, wav_path: str) -> None:
-        """
-        Converts MIDI file to WAV using fluidsynth.
+    def __init__(self):
+        """Initialize service; the synthesizer is created on first use or by start()."""
+        self._synth = None
+        self._sfid = None
+        self._synth_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._buffer_pool = deque()
+        self._pool_lock = threading.Lock()
 
-        Args:
-            midi_path: Path to input MIDI file
-            wav_path: Path where WAV file should be saved
+    @staticmethod
+    def verify_soundfont() -> None:
+        """
+        Checks that the configured SoundFont exists.
 
         Raises:
-            RuntimeError: If fluidsynth conversion fails
-            FileNotFoundError: If MIDI file or SoundFont not found
+            FileNotFoundError: If SoundFont not found
         """
-        # Verify MIDI file exists
-        if not os.path.exists(midi_path):
-            raise FileNotFoundError(f"MIDI file not found: {midi_path}")
-
-        # Verify SoundFont exists
         if not os.path.exists(settings.SOUNDFONT_PATH):
             raise FileNotFoundError(f"SoundFont file not found: {settings.SOUNDFONT_PATH}")
 
-        # Build fluidsynth command (OPTIMIZED for speed)
-        # Correct order: fluidsynth -ni -F output.wav -r 22050 soundfont.sf2 input.mid
-        cmd = [
-            "fluidsynth",
-            "-ni",                          # Non-interactive mode
-            "-F", wav_path,                 # Output WAV file
-            "-r", "22050",                  # Sample rate (22.05kHz - 2x faster than 44.1kHz)
-            "-o", "synth.reverb.active=no", # Disable reverb for speed
-            "-o", "synth.chorus.active=no", # Disable chorus for speed
-            "-g", "1.0",                    # Gain (1.0 = normal volume)
-            settings.SOUNDFONT_PATH,        # SoundFont file
-            midi_path                       # Input MIDI file
-        ]
-
-        # Run fluidsynth
+    def start(self) -> None:
+        """
+        Creates the synthesizer and loads the SoundFont (only once, thread-safe).
+
+        Raises:
+            FileNotFoundError: If SoundFont not found
+            RuntimeError: If fluidsynth cannot load the SoundFont
+        """
+        with self._start_lock:
+            if self._synth is None:
+                self._load_synth()
+
+    def _load_synth(self) -> None:
+        """Creates the synthesizer and loads the SoundFont."""
+        self.verify_soundfont()
+
+        synth = fluidsynth.Synth(
+            gain=1.0,                       # Gain (1.0 = normal volume)
+            samplerate=float(SAMPLE_RATE),  # 22.05kHz - 2x faster than 44.1kHz
+            **{
+                "synth.reverb.active": 0,   # Disable reverb for speed
+                "synth.chorus.active": 0,   # Disable chorus for speed
+                "synth.polyphony": POLYPHONY
+            }
+        )
+        sfid = synth.sfload(settings.SOUNDFONT_PATH)
+        if sfid == -1:
+            synth.delete()
+            raise RuntimeError(f"Fluidsynth failed to load SoundFont: {settings.SOUNDFONT_PATH}")
+
+        self._synth = synth
+        self._sfid = sfid
+
+    def _warm_up(self, max_seconds: float) -> None:
+        """Loads the synthesizer and pre-sizes a pooled render buffer."""
+        self.start()
+        n_samples = (int(max_seconds * SAMPLE_RATE) + int(TAIL_SECONDS * SAMPLE_RATE)) * 2
+        self._release_buffer(self._acquire_buffer(n_samples))
+
+    async def warm_up(self, max_seconds: float = 0.0) -> None:
+        """
+        Prepares everything rendering needs, without blocking the event loop.
+
+        Meant to run concurrently with work that doesn't depend on it (the
+        OpenAI call), so the SoundFont load and buffer allocation are hidden
+        behind it. Best-effort: failures are logged, and rendering retries
+        the synthesizer setup and reports its own errors.
+
+        Args:
+            max_seconds: Longest expected render, used to pre-size the PCM buffer
+        """
         try:
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                check=True
-            )
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"Fluidsynth conversion failed: {e.stderr}")
+            await asyncio.to_thread(self._warm_up, max_seconds)
+        except Exception as e:
+            logger.warning("Synthesizer warm-up failed: %s", e)
 
-        # Verify WAV file was created
-        if not os.path.exists(wav_path):
-            raise RuntimeError("WAV file was not created")
+    def close(self) -> None:
+        """Releases the synthesizer."""
+        if self._synth is not None:
+            self._synth.delete()
+            self._synth = None
+            self._sfid = None
 
-    def wav_to_mp3(self, wav_path: str, mp3_path: str, bitrate: str = "192k") -> None:
+    def _acquire_buffer(self, n_samples: int) -> np.ndarray:
         """
-        Converts WAV file to MP3 using pydub (which uses ffmpeg).
+        Takes a pooled int16 buffer with room for n_samples, or allocates one.
 
         Args:
-            wav_path: Path to input WAV file
-            mp3_path: Path where MP3 file should be saved
-            bitrate: MP3 bitrate (default: 192k)
+            n_samples: Minimum number of int16 samples needed
+
+        Returns:
+            Buffer of at least n_samples samples (contents undefined)
+        """
+        # Pooled buffers are removed by index: deque.remove compares with ==,
+        # which NumPy arrays don't support as a plain truth value
+        with self._pool_lock:
+            for index, buffer in enumerate(self._buffer_pool):
+                if buffer.size >= n_samples:
+                    del self._buffer_pool[index]
+                    return buffer
+
+        # Grow to the steady-state maximum instead of reallocating per request
+        return np.empty(n_samples, dtype=np.int16)
+
+    def _release_buffer(self, buffer: np.ndarray) -> None:
+        """
+        Returns a buffer to the pool, dropping the smallest one if the pool is full.
+
+        Args:
+            buffer: Buffer previously returned by _acquire_buffer
+        """
+        with self._pool_lock:
+            self._buffer_pool.append(buffer)
+            if len(self._buffer_pool) > MAX_POOLED_BUFFERS:
+                pool = self._buffer_pool
+                del pool[min(range(len(pool)), key=lambda index: pool[index].size)]
+
+    def _write_samples(self, buffer: np.ndarray, frame_offset: int, frames: int) -> None:
+        """
+        Renders frames straight into an interleaved stereo buffer (no temporary array).
+
+        Args:
+            buffer: Interleaved stereo int16 buffer
+            frame_offset: First stereo frame to write
+            frames: Number of stereo frames to render
+        """
+        address = buffer.ctypes.data + frame_offset * 2 * buffer.itemsize
+        fluidsynth.fluid_synth_write_s16(self._synth.synth, frames, address, 0, 2, address, 1, 2)
+
+    def _render(self, midi_source: Union[str, bytes]) -> np.ndarray:
+        """
+        Renders a MIDI file with the shared synthesizer.
+
+        Args:
+            midi_source: Path to input MIDI file, or its contents
+
+        Returns:
+            Mono int16 PCM samples
+        """
+        if isinstance(midi_source, bytes):
+            midi = mido.MidiFile(file=io.BytesIO(midi_source))
+        else:
+            midi = mido.MidiFile(midi_source)
+        tail_frames = int(TAIL_SECONDS * SAMPLE_RATE)
+        body_frames = int(midi.length * SAMPLE_RATE)
+        stereo = self._acquire_buffer((body_frames + tail_frames) * 2)
+
+        frames_done = 0
+        elapsed = 0.0
+
+        try:
+            with self._synth_lock:
+                self.start()
+                synth = self._synth
+
+                # Reset every channel to its default bank/program
+                for channel in range(MIDI_CHANNELS):
+                    bank = DRUM_BANK if channel == DRUM_CHANNEL else 0
+                    synth.program_select(channel, self._sfid, bank, 0)
+
+                # Iterating a MidiFile yields messages with delta times in seconds
+                for msg in midi:
+                    elapsed += msg.time
+                    frames = min(int(elapsed * SAMPLE_RATE), body_frames) - frames_done
+                    if frames > 0:
+                        self._write_samples(stereo, frames_done, frames)
+                        frames_done += frames
+
+                    if msg.type == "note_on":
+                        synth.noteon(msg.channel, msg.note, msg.velocity)
+                    elif msg.type == "note_off":
+                        synth.noteoff(msg.channel, msg.note)
+                    elif msg.type == "program_change":
+                        bank = DRUM_BANK if msg.channel == DRUM_CHANNEL else 0
+                        synth.program_select(msg.channel, self._sfid, bank, msg.program)
+
+                # Let the last notes ring out
+                self._write_samples(stereo, frames_done, tail_frames)
+                frames_done += tail_frames
+
+                # All Sound Off + Reset All Controllers so the next render starts clean
+                for channel in range(MIDI_CHANNELS):
+                    synth.cc(channel, 120, 0)
+                    synth.cc(channel, 121, 0)
+
+            # Downmix to mono in the pooled buffer: halves the PCM bytes the encoder
+            # has to process. Halving each side first keeps the sum within int16.
+            left = stereo[0:frames_done * 2:2]
+            right = stereo[1:frames_done * 2:2]
+            np.right_shift(left, 1, out=left)
+            np.right_shift(right, 1, out=right)
+            np.add(left, right, out=left)
+
+            # The buffer goes back to the pool, so hand out a copy
+            return left.copy()
+        finally:
+            self._release_buffer(stereo)
+
+    async def render_pcm(self, midi_source: Union[str, bytes]) -> np.ndarray:
+        """
+        Renders a MIDI file to PCM with the shared synthesizer.
+
+        Args:
+            midi_source: Path to input MIDI file, or its contents (e.g. from
+                MidiService.convert_json_to_midi_bytes)
+
+        Returns:
+            Mono int16 PCM samples at SAMPLE_RATE
 
         Raises:
-            FileNotFoundError: If WAV file not found
-            RuntimeError: If conversion fails
+            RuntimeError: If fluidsynth rendering fails (including a missing MIDI file)
         """
-        # Verify WAV file exists
-        if not os.path.exists(wav_path):
-            raise FileNotFoundError(f"WAV file not found: {wav_path}")
+        # Render in a worker thread so synthesis doesn't block the event loop
+        try:
+            return await asyncio.to_thread(self._render, midi_source)
+        except (OSError, ValueError, EOFError) as e:
+            raise RuntimeError(f"Fluidsynth conversion failed: {str(e)}")
 
+    @staticmethod
+    def _new_encoder(bitrate: int) -> lameenc.Encoder:
+        """
+        Creates an MP3 encoder for the synthesizer's PCM format.
+
+        Args:
+            bitrate: MP3 bitrate in kbps
+
+        Returns:
+            Configured LAME encoder
+        """
+        encoder = lameenc.Encoder()
+        encoder.set_bit_rate(bitrate)
+        encoder.set_in_sample_rate(SAMPLE_RATE)
+        encoder.set_channels(1)
+        encoder.set_quality(2)  # Quality setting (0-9, lower is better)
+        return encoder
+
+    def encode_mp3(self, pcm: np.ndarray, bitrate: int = 192) -> bytes:
+        """
+        Encodes PCM to MP3 in a single LAME pass.
+
+        Args:
+            pcm: Mono int16 PCM samples from render_pcm
+            bitrate: MP3 bitrate in kbps (default: 192)
+
+        Returns:
+            MP3 bytes
+
+        Raises:
+            RuntimeError: If encoding fails
+        """
+        encoder = self._new_encoder(bitrate)
         try:
-            # Load WAV file
-            audio = AudioSegment.from_wav(wav_path)
-
-            # Export as MP3
-            audio.export(
-                mp3_path,
-                format="mp3",
-                bitrate=bitrate,
-                parameters=["-q:a", "2"]  # Quality setting (0-9, lower is better)
-            )
+            return bytes(encoder.encode(pcm.tobytes()) + encoder.flush())
         except Exception as e:
             raise RuntimeError(f"MP3 conversion failed: {str(e)}")
 
-        # Verify MP3 file was created
-        if not os.path.exists(mp3_path):
-            raise RuntimeError("MP3 file was not created")
+    def encode_mp3_stream(
+        self,
+        pcm: np.ndarray,
+        bitrate: int = 192,
+        block_frames: int = SAMPLE_RATE
+    ) -> AsyncIterator[bytes]:
+        """
+        Encodes PCM to MP3 block by block, yielding output as it is produced.
+
+        The encoder is created before returning so setup failures surface
+        here rather than after a response has started.
+
+        Args:
+            pcm: Mono int16 PCM samples from render_pcm
+            bitrate: MP3 bitrate in kbps (default: 192)
+            block_frames: Samples encoded per chunk (default: 1 second)
+
+        Returns:
+            Async iterator of MP3 byte chunks
+        """
+        return self._encode_blocks(self._new_encoder(bitrate), pcm, block_frames)
+
+    @staticmethod
+    async def _encode_blocks(
+        encoder: lameenc.Encoder,
+        pcm: np.ndarray,
+        block_frames: int
+    ) -> AsyncIterator[bytes]:
+        """
+        Feeds PCM blocks to the encoder in a worker thread and yields the MP3 output.
+
+        Raises:
+            RuntimeError: If encoding fails
+        """
+        try:
+            for offset in range(0, len(pcm), block_frames):
+                block = pcm[offset:offset + block_frames].tobytes()
+                chunk = await asyncio.to_thread(encoder.encode, block)
+                if chunk:
+                    yield bytes(chunk)
 
-    def midi_to_mp3(self, midi_path: str, mp3_path: str, cleanup_wav: bool = True) -> None:
+            tail = encoder.flush()
+            if tail:
+                yield bytes(tail)
+        except RuntimeError as e:
+            raise RuntimeError(f"MP3 conversion failed: {str(e)}")
+
+    async def midi_to_mp3(self, midi_path: str, mp3_path: str, bitrate: int = 192) -> None:
         """
-        Converts MIDI directly to MP3 (via WAV intermediate).
+        Converts MIDI to an MP3 file without an intermediate WAV file.
+
+        PCM is rendered in memory by the shared synthesizer and encoded
+        in-process with LAME.
 
         Args:
             midi_path: Path to input MIDI file
             mp3_path: Path where MP3 file should be saved
-            cleanup_wav: Whether to delete intermediate WAV file (default: True)
+            bitrate: MP3 bitrate in kbps (default: 192)
 
         Raises:
-            RuntimeError: If conversion fails
+            RuntimeError: If fluidsynth rendering or MP3 encoding fails
         """
-        # Create temporary WAV path
-        wav_path = mp3_path.replace(".mp3", ".wav")
+        mp3_bytes = await self.midi_to_mp3_bytes(midi_path, bitrate)
 
-        try:
-            # MIDI → WAV
-            self.midi_to_wav(midi_path, wav_path)
+        with open(mp3_path, "wb") as f:
+            f.write(mp3_bytes)
 
-            # WAV → MP3
-            self.wav_to_mp3(wav_path, mp3_path)
+    async def midi_to_mp3_bytes(self, midi_source: Union[str, bytes], bitrate: int = 192) -> bytes:
+        """
+        Converts MIDI to MP3 bytes entirely in memory.
 
-        finally:
-            # Cleanup WAV file if requested
-            if cleanup_wav and os.path.exists(wav_path):
-                try:
-                    os.remove(wav_path)
-                except Exception:
-                    pass  # Silent failure for cleanup
+        Args:
+            midi_source: Path to input MIDI file, or its contents
+            bitrate: MP3 bitrate in kbps (default: 192)
+
+        Returns:
+            MP3 bytes
+
+        Raises:
+            RuntimeError: If fluidsynth rendering or MP3 encoding fails
+        """
+        pcm = await self.render_pcm(midi_source)
+        return await asyncio.to_thread(self.encode_mp3, pcm, bitrate)
 
 
 # Example usage for testing
 if __name__ == "__main__":
     import sys
 
+    async def test_conversion(service: AudioService, midi_file: str) -> None:
+        """Test MIDI → MP3 conversion."""
+        mp3_file = "/tmp/test.mp3"
+        print(f"Converting {midi_file} to MP3...")
+        await service.midi_to_mp3(midi_file, mp3_file)
+        print(f"✓ MP3 created: {mp3_file}")
+
     if len(sys.argv) > 1:
         midi_file = sys.argv[1]
         service = AudioService()
 
         try:
-            # Test MIDI → WAV
-            wav_file = "/tmp/test.wav"
-            print(f"Converting {midi_file} to WAV...")
-            service.midi_to_wav(midi_file, wav_file)
-            print(f"✓ WAV created: {wav_file}")
-
-            # Test WAV → MP3
-            mp3_file = "/tmp/test.mp3"
-            print(f"Converting WAV to MP3...")
-            service.wav_to_mp3(wav_file, mp3_file)
-            print(f"✓ MP3 created: {mp3_file}")
+            asyncio.run(test_conversion(service, midi_file))
 
             print("\nAudio conversion pipeline successful!")
         except Exception as e:
@@ -0,0 +1,303 @@
+"""
+Cache Service: Content-addressed storage for generated MP3 files.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import orjson
+from app.config import settings
+
+
+class AudioCache:
+    """Disk cache of rendered MP3 files with LRU eviction bounded by total bytes."""
+
+    # Suffix of MP3s still being written into cache_dir (ignored by evict)
+    PARTIAL_SUFFIX = ".mp3.part"
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory holding cached MP3 files and header sidecars
+            max_bytes: Maximum total size of cached MP3 files
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # Bytes on disk, tracked across stores so the directory is only
+        # scanned when the limit is exceeded (None until the first scan)
+        self._total_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(params: dict) -> str:
+        """
+        Build a cache key from request parameters.
+
+        Args:
+            params: JSON-serializable request parameters
+
+        Returns:
+            Hex digest identifying the parameters
+        """
+        return hashlib.blake2b(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    @staticmethod
+    def make_file_key(path: str) -> str:
+        """
+        Build a cache key from a file's contents.
+
+        Args:
+            path: File to hash (e.g. a rendered MIDI file)
+
+        Returns:
+            Hex digest identifying the file contents
+        """
+        with open(path, "rb") as f:
+            return hashlib.blake2b(f.read()).hexdigest()
+
+    def _mp3_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def lookup(self, key: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        Look up a cached MP3.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Tuple of (mp3 path, response headers), or None on miss
+        """
+        mp3_path = self._mp3_path(key)
+        try:
+            with open(self._meta_path(key), "rb") as f:
+                headers = orjson.loads(f.read())
+            # Refresh mtime so eviction treats this entry as recently used
+            os.utime(mp3_path)
+        except (OSError, ValueError):
+            return None
+
+        return mp3_path, headers
+
+    def store(self, key: str, src_path: str, headers: Dict[str, str]) -> str:
+        """
+        Move a rendered MP3 into the cache.
+
+        Blocking (file I/O and possibly a directory scan); call it from a
+        worker thread in async code.
+
+        Args:
+            key: Cache key
+            src_path: Path of the rendered MP3 (moved, not copied); a rename
+                when it is inside cache_dir
+            headers: Response headers to replay on cache hits
+
+        Returns:
+            Path of the cached MP3
+        """
+        mp3_path = self._mp3_path(key)
+        size = os.path.getsize(src_path)
+        is_new = not os.path.exists(mp3_path)
+        shutil.move(src_path, mp3_path)
+
+        # Write sidecar last so a partial entry is never reported as a hit
+        meta_tmp = f"{self._meta_path(key)}.tmp"
+        with open(meta_tmp, "wb") as f:
+            f.write(orjson.dumps(headers))
+        os.replace(meta_tmp, self._meta_path(key))
+
+        with self._lock:
+            if self._total_bytes is not None and is_new:
+                self._total_bytes += size
+            needs_scan = self._total_bytes is None or self._total_bytes > self.max_bytes
+        if needs_scan:
+            self.evict()
+        return mp3_path
+
+    def link(self, key: str, target_key: str, headers: Dict[str, str]) -> None:
+        """
+        Make an existing cached MP3 available under a second key.
+
+        Args:
+            key: New cache key
+            target_key: Key of the already cached MP3
+            headers: Response headers to replay on hits for the new key
+        """
+        mp3_path = self._mp3_path(key)
+        if os.path.exists(mp3_path):
+            return
+        try:
+            os.link(self._mp3_path(target_key), mp3_path)
+        except OSError:
+            return  # Linked concurrently, or the target was just evicted
+
+        meta_tmp = f"{self._meta_path(key)}.tmp"
+        with open(meta_tmp, "wb") as f:
+            f.write(orjson.dumps(headers))
+        os.replace(meta_tmp, self._meta_path(key))
+
+    def remove_partial(self) -> None:
+        """Delete partially written MP3s left behind by an interrupted stream or a crash."""
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return
+
+        for name in names:
+            if name.endswith(self.PARTIAL_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass  # Silent failure for cleanup
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return
+
+        # Entries are hard-linked under several keys, so group names by inode:
+        # each file counts once and is only freed once all its names are gone
+        files: Dict[Tuple[int, int], Tuple[float, int, List[str]]] = {}
+        for name in names:
+            if not name.endswith(".mp3"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            inode = (stat.st_dev, stat.st_ino)
+            if inode in files:
+                mtime, size, keys = files[inode]
+                files[inode] = (max(mtime, stat.st_mtime), size, keys)
+            else:
+                files[inode] = (stat.st_mtime, stat.st_size, [])
+            files[inode][2].append(name[:-4])
+
+        total_bytes = sum(size for _, size, _ in files.values())
+
+        # Oldest first
+        for _, size, keys in sorted(files.values()):
+            if total_bytes <= self.max_bytes:
+                break
+            for key in keys:
+                for path in [self._meta_path(key), self._mp3_path(key)]:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass  # Silent failure for cleanup
+            total_bytes -= size
+
+        with self._lock:
+            self._total_bytes = total_bytes
+
+
+class SemanticIndex:
+    """In-memory nearest-neighbour index mapping prompt embeddings to cache keys."""
+
+    # Rows allocated for a new partition; doubled as needed up to max_entries
+    INITIAL_CAPACITY = 64
+
+    def __init__(self, threshold: float, max_entries: int = 4096):
+        """
+        Initialize the index.
+
+        Args:
+            threshold: Minimum cosine similarity for a match
+            max_entries: Entries kept per partition (oldest overwritten first)
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # Partitioned by bar count and requested tempo so a match never changes
+        # the loop length or ignores an explicit tempo. Each partition is a
+        # ring buffer: (vectors, keys, number of filled rows, next row to write)
+        self._partitions: Dict[Tuple[int, Optional[int]], List] = {}
+        self._lock = threading.Lock()
+
+    def has_entries(self, bars: int, tempo: Optional[int]) -> bool:
+        """
+        Check whether a search could match anything (skip embedding the request if not).
+
+        Args:
+            bars: Number of bars requested
+            tempo: Requested tempo, or None if the model picks it
+
+        Returns:
+            True if the partition holds at least one entry
+        """
+        with self._lock:
+            return (bars, tempo) in self._partitions
+
+    def search(self, embedding: np.ndarray, bars: int, tempo: Optional[int]) -> Optional[str]:
+        """
+        Find the cache key of the most similar past request.
+
+        Args:
+            embedding: Unit-length embedding of the request
+            bars: Number of bars requested
+            tempo: Requested tempo, or None if the model picks it
+
+        Returns:
+            Cache key of the best match above the threshold, or None
+        """
+        with self._lock:
+            partition = self._partitions.get((bars, tempo))
+            if partition is None:
+                return None
+            vectors, keys, count, _ = partition
+            # Rows are unit length, so the inner product is the cosine similarity
+            similarities = vectors[:count] @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            return keys[best]
+
+    def add(self, embedding: np.ndarray, bars: int, tempo: Optional[int], key: str) -> None:
+        """
+        Register a cached result under its request embedding.
+
+        Args:
+            embedding: Unit-length embedding of the request
+            bars: Number of bars requested
+            tempo: Requested tempo, or None if the model picks it
+            key: Cache key of the stored MP3
+        """
+        with self._lock:
+            partition = self._partitions.get((bars, tempo))
+            if partition is None:
+                capacity = min(self.INITIAL_CAPACITY, self.max_entries)
+                vectors = np.empty((capacity, embedding.shape[0]), dtype=embedding.dtype)
+                partition = [vectors, [None] * capacity, 0, 0]
+                self._partitions[(bars, tempo)] = partition
+            vectors, keys, count, position = partition
+
+            # Grow by doubling until max_entries, then overwrite the oldest row
+            if position == len(vectors) and len(vectors) < self.max_entries:
+                capacity = min(len(vectors) * 2, self.max_entries)
+                grown = np.empty((capacity, vectors.shape[1]), dtype=vectors.dtype)
+                grown[:count] = vectors[:count]
+                keys.extend([None] * (capacity - len(keys)))
+                vectors = partition[0] = grown
+            position %= len(vectors)
+
+            vectors[position] = embedding
+            keys[position] = key
+            partition[2] = max(count, position + 1)
+            partition[3] = position + 1
+
+
+# Global cache instances
+audio_cache = AudioCache(
+    cache_dir=settings.CACHE_DIR,
+    max_bytes=settings.CACHE_MAX_BYTES
+)
+semantic_index = SemanticIndex(threshold=settings.SEMANTIC_CACHE_THRESHOLD)
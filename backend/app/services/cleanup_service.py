@@ -0,0 +1,82 @@
+"""
+Cleanup Service: Deletes temporary files off the request path.
+"""
+
+import asyncio
+import os
+from typing import List, Optional
+
+
+def remove_files(paths: List[str]) -> None:
+    """
+    Deletes files, ignoring ones that were already moved or removed.
+
+    Args:
+        paths: Paths to delete
+    """
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Silent failure for cleanup
+
+
+class CleanupService:
+    """Queues temp file deletions and sweeps them in a background worker."""
+
+    def __init__(self, sweep_interval: float = 30.0):
+        """
+        Initialize the service.
+
+        Args:
+            sweep_interval: Seconds to collect paths before deleting them in one batch
+        """
+        self.sweep_interval = sweep_interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending: List[str] = []
+        self._worker: Optional[asyncio.Task] = None
+
+    def schedule(self, *paths: str) -> None:
+        """
+        Queues files for deletion without touching the filesystem.
+
+        Args:
+            paths: Paths to delete
+        """
+        for path in paths:
+            self._queue.put_nowait(path)
+
+    def _drain(self) -> List[str]:
+        """Removes and returns every queued path."""
+        paths = []
+        while not self._queue.empty():
+            paths.append(self._queue.get_nowait())
+        return paths
+
+    async def _run(self) -> None:
+        """Worker loop: wait for work, coalesce for one interval, delete in a thread."""
+        while True:
+            self._pending.append(await self._queue.get())
+            await asyncio.sleep(self.sweep_interval)
+            self._pending.extend(self._drain())
+
+            batch, self._pending = self._pending, []
+            await asyncio.to_thread(remove_files, batch)
+
+    def start(self) -> None:
+        """Starts the background worker (call from the app lifespan)."""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the worker and deletes anything still queued."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        remove_files(self._pending + self._drain())
+        self._pending = []
@@ -1,65 +1,166 @@
 """
-MIDI Service: Converts music JSON to MIDI files using pretty_midi.
+MIDI Service: Converts music JSON to MIDI files using mido.
 """
 
-import pretty_midi
-from app.models import MusicSchema
+import io
+from typing import List, Tuple
+import mido
+import numpy as np
+from app.models import MusicSchema, TrackSchema
+
+
+# MIDI file settings
+TICKS_PER_BEAT = 480        # Resolution of one quarter note
+DRUM_CHANNEL = 9            # General MIDI percussion channel (10, zero-based)
+MELODIC_CHANNELS = [channel for channel in range(16) if channel != DRUM_CHANNEL]
+DEFAULT_TIME_SIGNATURE = (4, 4)
 
 
 class MidiService:
     """Service for converting music JSON to MIDI files."""
 
-    def convert_json_to_midi(self, music_data: MusicSchema, output_path: str) -> None:
+    @staticmethod
+    def _time_signature(values: List[int]) -> Tuple[int, int]:
         """
-        Converts music JSON schema to a MIDI file.
+        Returns the time signature to write, falling back to 4/4.
+
+        The schema accepts any list of ints, but a MIDI time signature needs a
+        numerator of 1-255 and a power-of-two denominator.
+
+        Args:
+            values: time_signature from the composition metadata
+
+        Returns:
+            (numerator, denominator)
+        """
+        if len(values) != 2:
+            return DEFAULT_TIME_SIGNATURE
+        numerator, denominator = values
+        if not 1 <= numerator <= 255 or denominator < 1 or denominator & (denominator - 1):
+            return DEFAULT_TIME_SIGNATURE
+        return numerator, denominator
+
+    @staticmethod
+    def _build_track(track: TrackSchema, channel: int) -> mido.MidiTrack:
+        """
+        Builds a MIDI track with note events in delta-tick order.
+
+        Args:
+            track: Track to convert
+            channel: MIDI channel for the track
+
+        Returns:
+            MidiTrack with name, program change and note events
+        """
+        midi_track = mido.MidiTrack()
+        midi_track.append(mido.MetaMessage("track_name", name=track.name, time=0))
+        midi_track.append(mido.Message("program_change", channel=channel, program=track.midi_program, time=0))
+
+        # Gather note fields into arrays
+        notes = track.notes
+        count = len(notes)
+        starts = np.fromiter((note.start_time for note in notes), dtype=np.float64, count=count)
+        durations = np.fromiter((note.duration for note in notes), dtype=np.float64, count=count)
+        pitches = np.fromiter((note.pitch for note in notes), dtype=np.int64, count=count)
+        velocities = np.fromiter((note.velocity for note in notes), dtype=np.int64, count=count)
+
+        # Times are in quarter notes, so ticks are a single multiply (no tempo math)
+        on_ticks = np.rint(starts * TICKS_PER_BEAT).astype(np.int64)
+        off_ticks = np.rint((starts + durations) * TICKS_PER_BEAT).astype(np.int64)
+        off_ticks = np.maximum(off_ticks, on_ticks + 1)  # Keep every note audible
+
+        # All events sorted by tick; at equal ticks note-offs go first
+        ticks = np.concatenate((off_ticks, on_ticks))
+        is_on = np.concatenate((np.zeros(count, dtype=bool), np.ones(count, dtype=bool)))
+        order = np.lexsort((is_on, ticks))
+        deltas = np.diff(ticks[order], prepend=0)
+        event_pitches = np.concatenate((pitches, pitches))[order]
+        event_velocities = np.where(is_on, np.concatenate((velocities, velocities)), 0)[order]
+
+        midi_track.extend(
+            mido.Message(
+                "note_on" if on else "note_off",
+                channel=channel,
+                note=pitch,
+                velocity=velocity,
+                time=delta
+            )
+            for on, pitch, velocity, delta in zip(
+                is_on[order].tolist(),
+                event_pitches.tolist(),
+                event_velocities.tolist(),
+                deltas.tolist()
+            )
+        )
+
+        return midi_track
+
+    def _build_midi(self, music_data: MusicSchema) -> mido.MidiFile:
+        """
+        Builds an in-memory MIDI file from music JSON schema.
 
         Args:
             music_data: MusicSchema object containing the composition
-            output_path: Path where the MIDI file should be saved
+
+        Returns:
+            Type 1 MidiFile with a conductor track plus one track per instrument
 
         Raises:
             ValueError: If music data is invalid
-            IOError: If file cannot be written
         """
-        # Create MIDI object with the specified tempo
-        midi = pretty_midi.PrettyMIDI(initial_tempo=float(music_data.metadata.tempo))
+        midi = mido.MidiFile(type=1, ticks_per_beat=TICKS_PER_BEAT)
 
-        # Calculate seconds per beat based on tempo
-        tempo = music_data.metadata.tempo
-        seconds_per_beat = 60.0 / tempo
+        # Conductor track: tempo and time signature
+        numerator, denominator = self._time_signature(music_data.metadata.time_signature)
+        conductor = mido.MidiTrack()
+        conductor.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(music_data.metadata.tempo), time=0))
+        conductor.append(mido.MetaMessage("time_signature", numerator=numerator, denominator=denominator, time=0))
+        midi.tracks.append(conductor)
 
         # Process each track
+        # Drums use channel 10, others take the remaining channels in order
+        melodic_index = 0
         for track in music_data.tracks:
-            # Create instrument
-            # Drums use channel 10 (is_drum=True), others are melodic
-            is_drum_track = track.instrument.lower() == "drums"
-            instrument = pretty_midi.Instrument(
-                program=track.midi_program,
-                is_drum=is_drum_track,
-                name=track.name
-            )
+            if track.instrument.lower() == "drums":
+                channel = DRUM_CHANNEL
+            else:
+                channel = MELODIC_CHANNELS[melodic_index % len(MELODIC_CHANNELS)]
+                melodic_index += 1
 
-            # Add notes to the instrument
-            for note_data in track.notes:
-                # Convert timing from quarter notes to seconds
-                start_time_sec = note_data.start_time * seconds_per_beat
-                end_time_sec = (note_data.start_time + note_data.duration) * seconds_per_beat
+            midi.tracks.append(self._build_track(track, channel))
 
-                # Create MIDI note
-                midi_note = pretty_midi.Note(
-                    velocity=note_data.velocity,
-                    pitch=note_data.pitch,
-                    start=start_time_sec,
-                    end=end_time_sec
-                )
+        return midi
 
-                instrument.notes.append(midi_note)
+    def convert_json_to_midi(self, music_data: MusicSchema, output_path: str) -> None:
+        """
+        Converts music JSON schema to a MIDI file.
 
-            # Add instrument to MIDI
-            midi.instruments.append(instrument)
+        Args:
+            music_data: MusicSchema object containing the composition
+            output_path: Path where the MIDI file should be saved
 
-        # Write MIDI file
-        midi.write(output_path)
+        Raises:
+            ValueError: If music data is invalid
+            IOError: If file cannot be written
+        """
+        self._build_midi(music_data).save(output_path)
+
+    def convert_json_to_midi_bytes(self, music_data: MusicSchema) -> bytes:
+        """
+        Converts music JSON schema to MIDI file bytes without touching the disk.
+
+        Args:
+            music_data: MusicSchema object containing the composition
+
+        Returns:
+            Standard MIDI file contents
+
+        Raises:
+            ValueError: If music data is invalid
+        """
+        buffer = io.BytesIO()
+        self._build_midi(music_data).save(file=buffer)
+        return buffer.getvalue()
 
 
 # Example usage for testing
@@ -2,21 +2,276 @@
 OpenAI Service: Handles communication with OpenAI API for music generation.
 """
 
-import json
-from typing import Optional
-from openai import OpenAI
+import asyncio
+import hashlib
+import logging
+import random
+from typing import Dict, List, Optional
+import httpx
+import numpy as np
+import orjson
+from cachetools import TTLCache
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI
+from pydantic import ValidationError
 from app.config import settings
-from app.models import MusicSchema
-from app.utils.prompt_builder import PromptBuilder
+from app.models import MetadataSchema, MusicSchema, NoteSchema, TrackSchema
+from app.utils.prompt_builder import PromptBuilder, estimated_tokens
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to the NumPy implementation
+    njit = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# Structured output: the API constrains the completion to the MusicSchema layout
+MUSIC_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "music",
+        "schema": MusicSchema.model_json_schema(),
+        "strict": False  # Strict mode rejects the numeric bounds/patterns in the schema
+    }
+}
+
+# Backoff before retrying a rate-limited or dropped request (doubles per attempt)
+RETRY_BASE_DELAY = 0.5  # Seconds
+RETRY_JITTER = 0.25  # Seconds
+# Status codes the SDK's own retry logic treats as transient (plus any 5xx)
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+# Identical for every request (first part of the stable prompt prefix)
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "Professional music composer. Output only valid JSON, no other text."
+}
+
+# Structure-of-arrays layout for note processing (pitch/velocity fit in int8)
+NOTE_DTYPE = np.dtype([("pitch", "i1"), ("start", "f8"), ("dur", "f8"), ("vel", "i1")])
+
+
+def _extend_notes_np(starts, durs, pattern_length, target_length, reps, out_index, out_starts, out_durs):
+    """
+    Repeat a note pattern up to target_length (vectorized NumPy version).
+
+    Results are written to the front of the caller's scratch buffers, which
+    must hold at least len(starts) * reps entries.
+
+    Args:
+        starts: Note start times in quarter notes
+        durs: Note durations in quarter notes
+        pattern_length: Loop length in quarter notes
+        target_length: Length to fill in quarter notes
+        reps: Number of repetitions to generate
+        out_index: Scratch buffer for source note indices
+        out_starts: Scratch buffer for start times
+        out_durs: Scratch buffer for clipped durations
+
+    Returns:
+        Number of notes written
+    """
+    n = starts.shape[0]
+    total = n * reps
+    grid_index = out_index[:total].reshape(reps, n)
+    grid_starts = out_starts[:total].reshape(reps, n)
+    grid_durs = out_durs[:total].reshape(reps, n)
+
+    grid_index[:] = np.arange(n)
+    np.add(starts, (np.arange(reps, dtype=np.float64) * pattern_length)[:, None], out=grid_starts)
+    np.subtract(target_length, grid_starts, out=grid_durs)
+    np.minimum(grid_durs, durs, out=grid_durs)
+
+    # Keep notes that start within the target, clipping durations that run past it
+    keep = (out_starts[:total] < target_length) & (out_durs[:total] > 0)
+    count = int(np.count_nonzero(keep))
+    out_index[:count] = out_index[:total][keep]
+    out_starts[:count] = out_starts[:total][keep]
+    out_durs[:count] = out_durs[:total][keep]
+    return count
+
+
+def _extend_notes_loop(starts, durs, pattern_length, target_length, reps, out_index, out_starts, out_durs):
+    """Scalar-loop version of _extend_notes_np, compiled with numba when available."""
+    n = starts.shape[0]
+    k = 0
+    for rep in range(reps):
+        offset = pattern_length * rep
+        for i in range(n):
+            new_start = starts[i] + offset
+            if new_start >= target_length:
+                continue
+            duration = min(durs[i], target_length - new_start)
+            if duration <= 0:
+                continue
+            out_index[k] = i
+            out_starts[k] = new_start
+            out_durs[k] = duration
+            k += 1
+    return k
+
+
+class _TrackScanner:
+    """
+    Finds complete track objects in a streamed MusicSchema JSON document.
+
+    Tracks bracket depth (ignoring brackets inside strings) and reports each
+    object that opens directly inside the top-level "tracks" array as soon
+    as its closing brace arrives. Objects that are direct members of the
+    document (the metadata) are collected in `members`.
+    """
+
+    def __init__(self):
+        self.text = []
+        self.members = []
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._offset = 0
+        self._track_start = None
+        self._member_start = None
+        self._closed = False
+        self._trailing = False
+
+    @property
+    def complete(self) -> bool:
+        """True once the top-level object has closed with nothing but whitespace after it."""
+        return self._closed and not self._trailing
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        Consume the next piece of the document.
+
+        Args:
+            chunk: Text appended to the document
+
+        Returns:
+            JSON text of every track object completed by this chunk
+        """
+        self.text.append(chunk)
+        completed = []
+        for i, char in enumerate(chunk):
+            if self._closed:
+                if not char.isspace():
+                    self._trailing = True
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if char == "{" and self._stack == ["{", "["]:
+                    self._track_start = self._offset + i
+                elif char == "{" and self._stack == ["{"]:
+                    self._member_start = self._offset + i
+                self._stack.append(char)
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                if char == "}" and self._stack == ["{", "["] and self._track_start is not None:
+                    document = "".join(self.text)
+                    completed.append(document[self._track_start:self._offset + i + 1])
+                    self._track_start = None
+                elif char == "}" and self._stack == ["{"] and self._member_start is not None:
+                    document = "".join(self.text)
+                    self.members.append(document[self._member_start:self._offset + i + 1])
+                    self._member_start = None
+                elif not self._stack:
+                    self._closed = True
+        self._offset += len(chunk)
+        return completed
+
+
+# Compiled loop when numba is installed (cached on disk to skip recompiling at startup)
+if njit is not None:
+    extend_notes = njit(cache=True)(_extend_notes_loop)
+else:
+    extend_notes = _extend_notes_np
+
+# Expected minimum notes per bar for each track
+EXPECTED_NOTES_PER_BAR = {
+    "drums": 8,
+    "bass": 2,
+    "melody": 4,
+}
+DEFAULT_NOTES_PER_BAR = 2
+
+# One 4/4 bar in sixteenth notes (the grid used for loop lengths)
+SIXTEENTHS_PER_BAR = 16
+
+# Completion budget: minified notes cost ~20 tokens, and the prompt asks for
+# at least 14 notes per bar (drums 8 + bass 2 + melody 4). Models often write
+# more notes or whitespace-formatted JSON, and a truncated completion fails as
+# invalid JSON and is retried, so budget for twice the minimum.
+TOKENS_PER_NOTE = 20
+MIN_NOTES_PER_BAR = 14
+NOTE_HEADROOM = 2
+RESPONSE_OVERHEAD_TOKENS = 200  # Metadata and track headers
+MAX_COMPLETION_TOKENS = 3200
 
 
 class OpenAIService:
     """Service for generating music JSON using OpenAI GPT-4 Turbo."""
 
+    # Generated compositions keyed by prompt inputs (shared across instances)
+    _cache: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+    _cache_lock = asyncio.Lock()
+
     def __init__(self):
-        """Initialize OpenAI client."""
-        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        self.prompt_builder = PromptBuilder()
+        """Initialize OpenAI client with a reusable connection pool."""
+        self.client = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            max_retries=0,  # Retries (with backoff) are handled in _generate_uncached
+            http_client=httpx.AsyncClient(
+                http2=True,  # Multiplex concurrent completions over one connection
+                limits=httpx.Limits(max_keepalive_connections=20)
+            )
+        )
+
+    async def close(self) -> None:
+        """Close the HTTP connection pool (call from the app lifespan on shutdown)."""
+        await self.client.close()
+
+    @staticmethod
+    def _track_to_soa(track: TrackSchema) -> np.ndarray:
+        """
+        Pack a track's notes into a structured array (one field per note attribute).
+
+        Args:
+            track: Track to convert
+
+        Returns:
+            Structured array with fields pitch, start, dur, vel
+        """
+        notes = track.notes
+        arr = np.empty(len(notes), dtype=NOTE_DTYPE)
+        arr["pitch"] = [note.pitch for note in notes]
+        arr["start"] = [note.start_time for note in notes]
+        arr["dur"] = [note.duration for note in notes]
+        arr["vel"] = [note.velocity for note in notes]
+        return arr
+
+    @staticmethod
+    def _track_endtime(track: TrackSchema) -> float:
+        """
+        Compute when a track's last note ends.
+
+        Args:
+            track: Track to measure
+
+        Returns:
+            Latest note end in quarter notes (0.0 for an empty track)
+        """
+        count = len(track.notes)
+        if count == 0:
+            return 0.0
+        # Single walk over the notes (end times only, no separate start/duration arrays)
+        ends = np.fromiter((note.start_time + note.duration for note in track.notes), dtype=np.float64, count=count)
+        return float(ends.max())
 
     def _extend_music_pattern(self, music_schema: MusicSchema, current_length: float, target_length: float) -> MusicSchema:
         """
@@ -31,69 +286,64 @@ class OpenAIService:
         Returns:
             Extended music schema
         """
-        from app.models import NoteSchema, TrackSchema
+        # Scratch buffers shared by all tracks, sized for the longest track at
+        # the most repetitions any track can need (1-bar patterns)
+        max_notes = max((len(track.notes) for track in music_schema.tracks), default=0)
+        max_reps = int(target_length * 4) // SIXTEENTHS_PER_BAR + 1
+        out_index = np.empty(max_notes * max_reps, dtype=np.int64)
+        out_starts = np.empty(max_notes * max_reps, dtype=np.float64)
+        out_durs = np.empty(max_notes * max_reps, dtype=np.float64)
 
         # Extend each track independently
         extended_tracks = []
         for track in music_schema.tracks:
+            arr = self._track_to_soa(track)
+
             # Calculate this track's actual pattern length
-            track_max_time = 0.0
-            for note in track.notes:
-                note_end = note.start_time + note.duration
-                if note_end > track_max_time:
-                    track_max_time = note_end
+            track_max_time = float((arr["start"] + arr["dur"]).max()) if arr.size else 0.0
 
             if track_max_time <= 0:
                 # Track has no notes, skip
                 extended_tracks.append(track)
                 continue
 
-            # Round to nearest bar (4 quarter notes) for clean looping
-            pattern_length = round(track_max_time / 4) * 4
-            if pattern_length == 0:
-                pattern_length = 4  # At least 1 bar
+            # Round to nearest bar for clean looping, in integer sixteenth notes (at least 1 bar)
+            # (rounded once, like the original round(track_max_time / 4) * 4)
+            pattern_16 = max(1, int(round(track_max_time / 4))) * SIXTEENTHS_PER_BAR
+            pattern_length = pattern_16 // 4
 
-            print(f"  Track '{track.name}': pattern_length={pattern_length} quarter notes, target={target_length}")
+            logger.debug("Track %s: pattern_length=%s target=%s quarter notes", track.name, pattern_length, target_length)
 
             # Calculate how many repetitions needed
-            repetitions_needed = int(target_length / pattern_length) + 1
-
-            extended_notes = []
-
-            # Copy and repeat notes
-            for rep in range(repetitions_needed):
-                offset = pattern_length * rep
-                for note in track.notes:
-                    new_start = note.start_time + offset
-                    new_end = new_start + note.duration
-
-                    # Only add if within target length
-                    if new_start < target_length:
-                        # Clip duration if it exceeds target
-                        if new_end > target_length:
-                            clipped_duration = target_length - new_start
-                            if clipped_duration > 0:
-                                extended_notes.append(
-                                    NoteSchema(
-                                        pitch=note.pitch,
-                                        start_time=new_start,
-                                        duration=clipped_duration,
-                                        velocity=note.velocity
-                                    )
-                                )
-                        else:
-                            extended_notes.append(
-                                NoteSchema(
-                                    pitch=note.pitch,
-                                    start_time=new_start,
-                                    duration=note.duration,
-                                    velocity=note.velocity
-                                )
-                            )
-
-            # Create extended track
+            repetitions_needed = int(target_length * 4) // pattern_16 + 1
+
+            # Repeat the pattern in time order, clipped to the target length
+            count = extend_notes(
+                np.ascontiguousarray(arr["start"]),
+                np.ascontiguousarray(arr["dur"]),
+                float(pattern_length),
+                float(target_length),
+                repetitions_needed,
+                out_index,
+                out_starts,
+                out_durs
+            )
+            index = out_index[:count]
+
+            # Values come from already-validated notes, so skip re-validation
+            extended_notes = [
+                NoteSchema.model_construct(pitch=pitch, start_time=start, duration=duration, velocity=velocity)
+                for pitch, start, duration, velocity in zip(
+                    arr["pitch"][index].tolist(),
+                    out_starts[:count].tolist(),
+                    out_durs[:count].tolist(),
+                    arr["vel"][index].tolist()
+                )
+            ]
+
+            # Create extended track (fields copied from the validated original)
             extended_tracks.append(
-                TrackSchema(
+                TrackSchema.model_construct(
                     name=track.name,
                     instrument=track.instrument,
                     midi_program=track.midi_program,
@@ -101,19 +351,61 @@ class OpenAIService:
                 )
             )
 
-            print(f"    → Extended from {len(track.notes)} to {len(extended_notes)} notes")
+            logger.debug("Track %s: extended from %d to %d notes", track.name, len(track.notes), len(extended_notes))
 
         # Update music schema with extended tracks
         music_schema.tracks = extended_tracks
         return music_schema
 
+    async def embed_request(self, genre: str, mood: str, tempo: Optional[int], bars: int) -> np.ndarray:
+        """
+        Embed generation parameters for near-duplicate lookup.
+
+        Args:
+            genre: Music genre
+            mood: Music mood
+            tempo: Optional specific tempo (BPM)
+            bars: Number of bars
+
+        Returns:
+            Unit-length embedding vector (float32)
+        """
+        text = f"{genre} {mood} {bars}bar"
+        if tempo:
+            text += f" {tempo}bpm"
+
+        response = await self.client.embeddings.create(
+            model="text-embedding-3-small",
+            input=text
+        )
+        embedding = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return embedding / np.linalg.norm(embedding)
+
+    @staticmethod
+    def _cache_key(genre: str, mood: str, tempo: Optional[int], bars: int) -> str:
+        """
+        Build the cache key for a set of generation parameters.
+
+        Args:
+            genre: Music genre
+            mood: Music mood
+            tempo: Optional specific tempo (BPM)
+            bars: Number of bars
+
+        Returns:
+            Hex digest identifying the prompt inputs
+        """
+        # Serialized as a JSON array so free-form genre/mood text can't run into the next field
+        return hashlib.blake2b(orjson.dumps([genre, mood, tempo, bars])).hexdigest()
+
     async def generate_music_json(
         self,
         genre: str,
         mood: str,
         tempo: Optional[int] = None,
         bars: int = 8,
-        max_retries: int = 3
+        max_retries: int = 3,
+        use_cache: bool = True
     ) -> MusicSchema:
         """
         Generate music JSON using OpenAI GPT-4 Turbo.
@@ -124,6 +416,50 @@ class OpenAIService:
             tempo: Optional specific tempo (BPM)
             bars: Number of bars (4, 8, or 16)
             max_retries: Maximum number of retry attempts (default: 3)
+            use_cache: Return a cached composition for identical inputs (default: True)
+
+        Returns:
+            MusicSchema object containing the generated composition
+
+        Raises:
+            ValueError: If OpenAI returns invalid JSON after all retries
+            Exception: If OpenAI API call fails
+        """
+        cache_key = self._cache_key(genre, mood, tempo, bars)
+
+        # Short-circuit identical requests without calling OpenAI
+        if use_cache:
+            async with self._cache_lock:
+                cached = self._cache.get(cache_key)
+            if cached is not None:
+                logger.info("Music cache hit %s", cache_key[:12])
+                return MusicSchema.model_validate_json(cached)
+
+        music_schema = await self._generate_uncached(genre, mood, tempo, bars, max_retries)
+
+        async with self._cache_lock:
+            self._cache[cache_key] = music_schema.model_dump_json()
+
+        return music_schema
+
+    async def _generate_uncached(
+        self,
+        genre: str,
+        mood: str,
+        tempo: Optional[int],
+        bars: int,
+        max_retries: int
+    ) -> MusicSchema:
+        """
+        Generate music JSON with OpenAI, retrying on invalid JSON, rate limits
+        and connection errors.
+
+        Args:
+            genre: Music genre
+            mood: Music mood
+            tempo: Optional specific tempo (BPM)
+            bars: Number of bars
+            max_retries: Maximum number of retry attempts
 
         Returns:
             MusicSchema object containing the generated composition
@@ -132,153 +468,172 @@ class OpenAIService:
             ValueError: If OpenAI returns invalid JSON after all retries
             Exception: If OpenAI API call fails
         """
-        # Build the prompt
-        prompt = self.prompt_builder.build_music_generation_prompt(
+        # Build the prompt (cached by PromptBuilder across requests with the same parameters);
+        # the static instructions come first so every prompt shares one prefix
+        messages = PromptBuilder.build_music_generation_messages(
             genre=genre,
             mood=mood,
             tempo=tempo,
             bars=bars
         )
 
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Estimated prompt tokens: %d", estimated_tokens(genre, mood, tempo, bars))
+
         last_error = None
 
-        # Retry loop for handling occasional JSON parsing failures
+        # Retry loop for occasional JSON parsing failures and transient API errors
         for attempt in range(max_retries):
             try:
-                print(f"\n=== ATTEMPT {attempt + 1}/{max_retries} ===")
+                logger.debug("Generation attempt %d/%d", attempt + 1, max_retries)
 
-                return await self._attempt_generation(prompt, bars)
+                return await self._attempt_generation(messages, bars)
+
+            except ValidationError as e:
+                # Only malformed JSON is worth retrying; schema errors fail as before
+                if not any(error["type"] == "json_invalid" for error in e.errors()):
+                    raise Exception(f"OpenAI API error: {str(e)}")
 
-            except json.JSONDecodeError as e:
                 last_error = e
-                print(f"\n!!! JSON PARSE ERROR on attempt {attempt + 1}/{max_retries} !!!")
-                print(f"Error: {e}")
+                logger.warning("JSON parse error on attempt %d/%d: %s", attempt + 1, max_retries, e)
 
                 if attempt < max_retries - 1:
-                    print(f"Retrying... ({attempt + 2}/{max_retries})\n")
+                    logger.info("Retrying (%d/%d)", attempt + 2, max_retries)
                     continue
                 else:
-                    print(f"Max retries reached. Giving up.")
+                    logger.error("Max retries reached, giving up")
                     raise ValueError(f"OpenAI returned invalid JSON after {max_retries} attempts: {str(e)}")
 
+            except (APIConnectionError, APIStatusError) as e:
+                # Timeouts, dropped connections, rate limits and server errors are
+                # transient: back off so the retry doesn't hit the same limit
+                transient = isinstance(e, APIConnectionError) or (
+                    e.status_code in RETRYABLE_STATUS_CODES or e.status_code >= 500
+                )
+                if not transient or attempt == max_retries - 1:
+                    raise Exception(f"OpenAI API error: {str(e)}")
+
+                delay = RETRY_BASE_DELAY * 2 ** attempt + random.random() * RETRY_JITTER
+                logger.warning(
+                    "Transient OpenAI error on attempt %d/%d, retrying in %.2fs: %s",
+                    attempt + 1, max_retries, delay, e
+                )
+                await asyncio.sleep(delay)
+
             except Exception as e:
-                # Don't retry for non-JSON errors
+                # Don't retry for other errors
                 raise Exception(f"OpenAI API error: {str(e)}")
 
         # Should never reach here, but just in case
         raise ValueError(f"Failed to generate valid music JSON after {max_retries} attempts")
 
-    async def _attempt_generation(self, prompt: str, bars: int) -> MusicSchema:
+    async def _attempt_generation(self, messages: List[Dict[str, str]], bars: int) -> MusicSchema:
         """
         Single attempt at generating music JSON.
 
         Args:
-            prompt: The generation prompt
+            messages: Prompt messages from PromptBuilder
             bars: Number of bars
 
         Returns:
             MusicSchema object
 
         Raises:
-            json.JSONDecodeError: If JSON parsing fails
+            ValidationError: If JSON parsing or schema validation fails
             Exception: If API call fails
         """
-        # Call OpenAI API with JSON mode
-        # Optimized max_tokens calculation (reduced by ~32% from previous version)
-        # Previous: 3000 + bars*100. New: 2000 + bars*80 (more efficient)
-        max_tokens = min(2000 + (bars * 80), 3200)  # Conservative optimization
+        # Size the completion budget to the notes the prompt asks for
+        max_tokens = min(
+            RESPONSE_OVERHEAD_TOKENS + bars * MIN_NOTES_PER_BAR * NOTE_HEADROOM * TOKENS_PER_NOTE,
+            MAX_COMPLETION_TOKENS
+        )
 
-        response = self.client.chat.completions.create(
+        stream = await self.client.chat.completions.create(
             model="gpt-4o-mini",  # GPT-4o-mini (10x faster, 1/10 price)
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a professional music composer AI that generates music compositions in JSON format. You output ONLY valid JSON with no additional text, comments, or explanations."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            response_format={"type": "json_object"},  # Enforce JSON output
+            messages=[SYSTEM_MESSAGE, *messages],
+            response_format=MUSIC_RESPONSE_FORMAT,  # Enforce schema-shaped JSON output
             temperature=0.75,  # Improved genre differentiation (reduced from 0.8)
-            max_tokens=max_tokens
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}  # Final chunk carries token usage
         )
 
-        # Extract JSON from response
-        json_str = response.choices[0].message.content
+        # Validate each track as soon as it is complete, so a malformed track
+        # aborts the stream instead of waiting for the rest of the completion
+        scanner = _TrackScanner()
+        tracks = []
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                for track_json in scanner.feed(chunk.choices[0].delta.content):
+                    tracks.append(TrackSchema.model_validate_json(track_json))
+        finally:
+            await stream.close()
+
+        json_str = "".join(scanner.text)
 
         # Log token usage for monitoring and optimization
-        usage = response.usage
-        efficiency = (usage.completion_tokens / max_tokens) * 100 if max_tokens > 0 else 0
-        print(f"\n=== TOKEN USAGE ===")
-        print(f"Prompt tokens: {usage.prompt_tokens}")
-        print(f"Completion tokens: {usage.completion_tokens}")
-        print(f"Total tokens: {usage.total_tokens}")
-        print(f"Max tokens allocated: {max_tokens}")
-        print(f"Efficiency: {efficiency:.1f}% (completion/max)")
-        print(f"==================\n")
+        if usage is not None:
+            # Prompt tokens served from OpenAI's prompt cache (reported by newer API versions)
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached_tokens = getattr(details, "cached_tokens", None) or 0
+            logger.debug(
+                "Token usage prompt=%d (cached=%d) completion=%d total=%d max=%d (%.1f%% of max)",
+                usage.prompt_tokens, cached_tokens, usage.completion_tokens, usage.total_tokens, max_tokens,
+                usage.completion_tokens / max_tokens * 100 if max_tokens > 0 else 0
+            )
 
         if not json_str:
             raise ValueError("OpenAI returned empty response")
 
-        # Parse JSON
-        music_data = json.loads(json_str)
-
-        # Validate against Pydantic schema
-        music_schema = MusicSchema(**music_data)
+        # Assemble the composition from the tracks validated while streaming, so
+        # they aren't parsed twice; anything unusual (truncated document, no
+        # tracks, extra top-level objects) gets the full-document validation
+        if scanner.complete and tracks and len(scanner.members) == 1:
+            music_schema = MusicSchema.model_construct(
+                metadata=MetadataSchema.model_validate_json(scanner.members[0]),
+                tracks=tracks
+            )
+        else:
+            music_schema = MusicSchema.model_validate_json(json_str)
 
         # Validate that music actually spans the requested bars
         expected_quarter_notes = bars * 4
 
-        # Check each track's length and note count
-        print(f"\n=== VALIDATING TRACK LENGTHS ===")
-        needs_extension = False
+        # Check each track's length and note count in one pass: (name, note count, end time)
+        results = [(track.name, len(track.notes), self._track_endtime(track)) for track in music_schema.tracks]
 
-        # Expected minimum notes per track
-        expected_notes = {
-            'drums': bars * 8,   # At least 8 notes per bar
-            'bass': bars * 2,    # At least 2 notes per bar
-            'melody': bars * 4,  # At least 4 notes per bar
-        }
-
-        for track in music_schema.tracks:
-            track_max = 0.0
-            for note in track.notes:
-                note_end = note.start_time + note.duration
-                if note_end > track_max:
-                    track_max = note_end
-
-            note_count = len(track.notes)
-            track_name_lower = track.name.lower()
-            expected = expected_notes.get(track_name_lower, bars * 2)
-
-            status = "✓" if note_count >= expected else "✗ TOO FEW"
-            print(f"  {track.name}: {note_count} notes (expected ≥{expected}) {status}, length: {track_max:.2f} quarter notes ({track_max/4:.2f} bars)")
+        if logger.isEnabledFor(logging.DEBUG):
+            for name, note_count, track_max in results:
+                expected = bars * EXPECTED_NOTES_PER_BAR.get(name.lower(), DEFAULT_NOTES_PER_BAR)
+                status = "ok" if note_count >= expected else "TOO FEW"
+                logger.debug(
+                    "Track %s: %d notes (expected >=%d) %s, length %.2f quarter notes (%.2f bars)",
+                    name, note_count, expected, status, track_max, track_max / 4
+                )
 
-            # If any track is less than 75% of expected, needs extension
-            if track_max < expected_quarter_notes * 0.75:
-                needs_extension = True
+        # If any track is less than 75% of expected, needs extension
+        needs_extension = any(track_max < expected_quarter_notes * 0.75 for _, _, track_max in results)
 
         # Auto-extend if any track is too short
         if needs_extension:
-            print(f"\nWARNING: Some tracks are too short!")
-            print(f"  Requested: {bars} bars ({expected_quarter_notes} quarter notes)")
-            print(f"  Auto-extending by repeating patterns...\n")
+            logger.info(
+                "Some tracks are shorter than %d bars (%d quarter notes); extending by repeating patterns",
+                bars, expected_quarter_notes
+            )
 
             # Extend the music by repeating the pattern
             music_schema = self._extend_music_pattern(music_schema, 0, expected_quarter_notes)
 
             # Verify extension worked
-            print(f"\n=== VERIFICATION AFTER EXTENSION ===")
-            for track in music_schema.tracks:
-                track_max = 0.0
-                for note in track.notes:
-                    note_end = note.start_time + note.duration
-                    if note_end > track_max:
-                        track_max = note_end
-                print(f"  {track.name}: {track_max:.2f} quarter notes ({track_max/4:.2f} bars)")
-            print(f"=================================\n")
+            if logger.isEnabledFor(logging.DEBUG):
+                for track in music_schema.tracks:
+                    track_max = self._track_endtime(track)
+                    logger.debug("Extended %s: %.2f quarter notes (%.2f bars)", track.name, track_max, track_max / 4)
 
         return music_schema
 
@@ -314,8 +669,8 @@ if __name__ == "__main__":
                 print(f"  - {track.name}: {len(track.notes)} notes (program {track.midi_program})")
 
             # Save to file for inspection
-            with open("/tmp/generated_music.json", "w") as f:
-                json.dump(music.model_dump(), f, indent=2)
+            with open("/tmp/generated_music.json", "wb") as f:
+                f.write(orjson.dumps(music.model_dump(), option=orjson.OPT_INDENT_2))
             print(f"\n✓ Full JSON saved to /tmp/generated_music.json")
 
         except Exception as e:
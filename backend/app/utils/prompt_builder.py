@@ -2,14 +2,37 @@
 Prompt Builder: Creates optimized prompts for OpenAI to generate music JSON.
 """
 
-from typing import Optional
+import functools
+import json
+import string
+from types import MappingProxyType
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to a character-based estimate
+    tiktoken = None
+
+# Tokenizer used by gpt-4o-mini, and the rough ratio used without tiktoken
+TOKEN_ENCODING = "o200k_base"
+CHARS_PER_TOKEN = 4
+
+
+class GenreInfo(NamedTuple):
+    """Prompt guidelines for one genre."""
+
+    tempo_range: str
+    harmonic_progressions: str
+    rhythm_pattern: str
+    instruments: str
+    characteristics: str
 
 
 class PromptBuilder:
     """Builds genre/mood-aware prompts for music generation."""
 
     # MIDI drum map reference
-    DRUM_MAP = {
+    DRUM_MAP = MappingProxyType({
         "kick": 36,
         "snare": 38,
         "closed_hi_hat": 42,
@@ -18,54 +41,54 @@ class PromptBuilder:
         "ride": 51,
         "floor_tom": 41,
         "high_tom": 48
-    }
+    })
 
     # Genre-specific guidelines (expanded with harmonic progressions)
-    GENRE_GUIDELINES = {
-        "edm": {
-            "tempo_range": "120-140",
-            "harmonic_progressions": "I-V-vi-IV, I-vi-IV-V (pop progressions)",
-            "rhythm_pattern": "Four-on-floor kick, offbeat hi-hats, syncopated snare",
-            "instruments": "Synth lead (81-87), Bass synth (38-39), Pad (88-95)",
-            "characteristics": "Build-ups, drops, sidechain compression feel"
-        },
-        "hiphop": {
-            "tempo_range": "80-100",
-            "harmonic_progressions": "i-VI-III-VII (minor), i-iv-v (modal)",
-            "rhythm_pattern": "Boom-bap (kick-snare), syncopated hi-hats, trap rolls",
-            "instruments": "808 bass (38-39), Electric piano (4-5), Strings (48-51)",
-            "characteristics": "Heavy bass, sample-like repetition"
-        },
-        "jazz": {
-            "tempo_range": "100-140",
-            "harmonic_progressions": "ii-V-I (Dm7-G7-Cmaj7), I-vi-ii-V turnaround, Use 7th chords",
-            "rhythm_pattern": "Swing feel, walking bass quarter notes, ride cymbal",
-            "instruments": "Piano (0-7), Upright bass (32-33), Brush drums",
-            "characteristics": "Complex voicings, syncopation, improvisation"
-        },
-        "rock": {
-            "tempo_range": "110-130",
-            "harmonic_progressions": "I-IV-V (power chords), I-V-vi-IV, vi-IV-I-V",
-            "rhythm_pattern": "Steady eighth notes, backbeat snare, crash on downbeats",
-            "instruments": "Distorted guitar (29-31), Electric bass (33-34), Rock drums",
-            "characteristics": "Power chords, driving rhythm, strong accents"
-        },
-        "ambient": {
-            "tempo_range": "60-90",
-            "harmonic_progressions": "Modal (static harmony), I-IV drone, Add9/sus2/sus4",
-            "rhythm_pattern": "Minimal drums, long sustained notes",
-            "instruments": "Pad (88-95), Strings (48-51), Bells/Chimes (8-15)",
-            "characteristics": "Atmospheric, spacious, no clear downbeat"
-        }
-    }
+    GENRE_GUIDELINES = MappingProxyType({
+        "edm": GenreInfo(
+            tempo_range="120-140",
+            harmonic_progressions="I-V-vi-IV, I-vi-IV-V (pop progressions)",
+            rhythm_pattern="Four-on-floor kick, offbeat hi-hats, syncopated snare",
+            instruments="Synth lead (81-87), Bass synth (38-39), Pad (88-95)",
+            characteristics="Build-ups, drops, sidechain compression feel"
+        ),
+        "hiphop": GenreInfo(
+            tempo_range="80-100",
+            harmonic_progressions="i-VI-III-VII (minor), i-iv-v (modal)",
+            rhythm_pattern="Boom-bap (kick-snare), syncopated hi-hats, trap rolls",
+            instruments="808 bass (38-39), Electric piano (4-5), Strings (48-51)",
+            characteristics="Heavy bass, sample-like repetition"
+        ),
+        "jazz": GenreInfo(
+            tempo_range="100-140",
+            harmonic_progressions="ii-V-I (Dm7-G7-Cmaj7), I-vi-ii-V turnaround, Use 7th chords",
+            rhythm_pattern="Swing feel, walking bass quarter notes, ride cymbal",
+            instruments="Piano (0-7), Upright bass (32-33), Brush drums",
+            characteristics="Complex voicings, syncopation, improvisation"
+        ),
+        "rock": GenreInfo(
+            tempo_range="110-130",
+            harmonic_progressions="I-IV-V (power chords), I-V-vi-IV, vi-IV-I-V",
+            rhythm_pattern="Steady eighth notes, backbeat snare, crash on downbeats",
+            instruments="Distorted guitar (29-31), Electric bass (33-34), Rock drums",
+            characteristics="Power chords, driving rhythm, strong accents"
+        ),
+        "ambient": GenreInfo(
+            tempo_range="60-90",
+            harmonic_progressions="Modal (static harmony), I-IV drone, Add9/sus2/sus4",
+            rhythm_pattern="Minimal drums, long sustained notes",
+            instruments="Pad (88-95), Strings (48-51), Bells/Chimes (8-15)",
+            characteristics="Atmospheric, spacious, no clear downbeat"
+        )
+    })
 
     # Mood-specific guidelines
-    MOOD_GUIDELINES = {
+    MOOD_GUIDELINES = MappingProxyType({
         "happy": "Major key, higher velocities (90-120), busy rhythms, uplifting",
         "sad": "Minor key, lower velocities (50-80), slower movement, melancholic",
         "energetic": "Fast tempo, many notes, strong accents, driving rhythm",
         "calm": "Slow tempo, sparse notes, soft dynamics, gentle"
-    }
+    })
 
     @staticmethod
     def build_music_generation_prompt(
@@ -86,85 +109,293 @@ class PromptBuilder:
         Returns:
             Formatted prompt string for OpenAI
         """
-        # Normalize genre/mood for lookup
-        genre_key = genre.lower().replace("-", "").replace(" ", "")
-        mood_key = mood.lower()
-
-        # Get genre-specific guidelines
-        genre_info = PromptBuilder.GENRE_GUIDELINES.get(genre_key, {
-            "tempo_range": "90-130",
-            "harmonic_progressions": "I-IV-V-I (basic progression)",
-            "rhythm_pattern": "Standard rhythm pattern",
-            "instruments": "General MIDI instruments",
-            "characteristics": "General music style"
-        })
-
-        # Get mood-specific guidelines
-        mood_info = PromptBuilder.MOOD_GUIDELINES.get(mood_key, "Appropriate to the specified mood")
-
-        # Calculate max quarter notes
-        max_quarter_notes = bars * 4
-
-        # Build tempo instruction
-        if tempo:
-            tempo_instruction = f"Use exactly {tempo} BPM as specified."
-        else:
-            tempo_instruction = f"Choose an appropriate tempo in the range {genre_info['tempo_range']} BPM based on the genre."
-
-        prompt = f"""Generate {bars}-bar {genre} music in JSON format.
-
-**REQUIREMENTS:**
-Genre: {genre} | Mood: {mood} | Tempo: {tempo_instruction} | Bars: {bars} ({max_quarter_notes} quarter notes in 4/4)
-
-**HARMONIC PROGRESSION (CRITICAL):**
-Style: {genre_info['harmonic_progressions']}
-- Use ii-V-I progressions (Dm7→G7→Cmaj7 in C major) for sophistication
-- Apply secondary dominants: V/V (D7→G7), V/vi (E7→Am) for variety
-- Bass notes MUST outline chord roots and change every 2-4 bars
-- Melody emphasizes chord tones (1, 3, 5, 7) with passing tones for movement
-
-**RHYTHM & STYLE:**
-Pattern: {genre_info['rhythm_pattern']}
-Instruments: {genre_info['instruments']}
-Character: {genre_info['characteristics']}
-Mood: {mood_info}
-
-**TRACKS (3-4 required):**
-1. drums (program 0): {bars*8}+ notes. MIDI: 36=Kick 38=Snare 42=HH 49=Crash
-2. bass (32-39): {bars*2}+ notes, outline chord roots
-3. melody (0-7/24-31/80-87): {bars*4}+ notes, emphasize chord tones
-4. chords (0-7/48-55): optional harmony
-
-**COMPOSITION RULES:**
-- Distribute notes evenly across 0-{max_quarter_notes} quarter notes (FULL {bars} bars)
-- Change harmony every 2-4 bars for interest
-- Align to rhythmic grid (quarter/eighth/sixteenth notes)
-- Key: Choose appropriate key. Scale: major (uplifting) or minor (melancholic)
-- Velocities: 0-127 for dynamics
-
-**OUTPUT (JSON only, no text):**
-{{"metadata":{{"tempo":<60-200>,"bars":{bars},"time_signature":[4,4],"key":"<C-B with #/b>","scale":"major/minor"}},
-"tracks":[{{"name":"drums","instrument":"drums","midi_program":0,"notes":[{{"pitch":<0-127>,"start_time":<0-{max_quarter_notes}>,"duration":<float>,"velocity":<0-127>}}]}},{{"name":"bass","instrument":"<bass>","midi_program":<32-39>,"notes":[...]}},{{"name":"melody","instrument":"<instrument>","midi_program":<int>,"notes":[...]}}]}}
-
-Generate musically coherent, genre-appropriate composition."""
-
-        return prompt
-
-
-# Example usage
-if __name__ == "__main__":
-    builder = PromptBuilder()
-
-    # Test prompt generation
-    prompt = builder.build_music_generation_prompt(
-        genre="EDM",
-        mood="Energetic",
-        tempo=128,
-        bars=8
+        return _build_prompt_cached(genre, mood, tempo, bars)
+
+    @staticmethod
+    def build_music_generation_messages(
+        genre: str,
+        mood: str,
+        tempo: Optional[int] = None,
+        bars: int = 8
+    ) -> List[Dict[str, str]]:
+        """
+        Builds the generation prompt as chat messages, static prefix first.
+
+        The first message is identical for every request and only the second
+        varies, so the prompt starts with a stable prefix. OpenAI only caches
+        prompts of 1024+ tokens, which this one is below on its own; check
+        the cached token count logged by OpenAIService before relying on it.
+
+        Args:
+            genre: Music genre (e.g., EDM, Jazz, Hip-Hop)
+            mood: Music mood (e.g., Happy, Sad, Energetic)
+            tempo: Optional specific tempo (BPM). If None, AI selects based on genre
+            bars: Number of bars to generate (4, 8, or 16)
+
+        Returns:
+            List of chat messages for OpenAI
+        """
+        return [
+            {"role": "system", "content": _STATIC_PREFIX},
+            {"role": "user", "content": _build_request_cached(genre, mood, tempo, bars)}
+        ]
+
+
+# Fallbacks for genres/moods without specific guidelines
+_DEFAULT_GENRE_INFO = GenreInfo(
+    tempo_range="90-130",
+    harmonic_progressions="I-IV-V-I (basic progression)",
+    rhythm_pattern="Standard rhythm pattern",
+    instruments="General MIDI instruments",
+    characteristics="General music style"
+)
+_DEFAULT_MOOD_INFO = "Appropriate to the specified mood"
+
+
+# Section templates, parsed once at import. Rendered only at import or on a
+# prompt cache miss, since the results are prebuilt or LRU-cached.
+_GENRE_TEMPLATE = string.Template("""Style: $harmonic_progressions
+Pattern: $rhythm_pattern
+Instruments: $instruments
+Character: $characteristics
+""")
+_MOOD_TEMPLATE = string.Template("Mood: $mood_info\n")
+_BARS_TEMPLATE = string.Template(
+    "Bars: $bars (0-$max_quarter_notes quarter notes, 4/4); "
+    "notes: drums $drum_notes+, bass $bass_notes+, melody $melody_notes+\n"
+)
+_REQUEST_TEMPLATE = string.Template(
+    "REQUEST\nGenerate $bars-bar $genre music.\n"
+    "Genre: $genre | Mood: $mood | Tempo: $tempo_instruction\n"
+)
+
+
+def _render_genre_block(genre_info: GenreInfo) -> str:
+    """Formats the style lines for one genre."""
+    return _GENRE_TEMPLATE.substitute(genre_info._asdict())
+
+
+# Genre/mood sections never change, so format them once at import
+_GENRE_BLOCKS = {
+    genre_key: _render_genre_block(genre_info)
+    for genre_key, genre_info in PromptBuilder.GENRE_GUIDELINES.items()
+}
+_DEFAULT_GENRE_BLOCK = _render_genre_block(_DEFAULT_GENRE_INFO)
+_MOOD_BLOCKS = {
+    mood_key: _MOOD_TEMPLATE.substitute(mood_info=mood_info)
+    for mood_key, mood_info in PromptBuilder.MOOD_GUIDELINES.items()
+}
+_DEFAULT_MOOD_BLOCK = _MOOD_TEMPLATE.substitute(mood_info=_DEFAULT_MOOD_INFO)
+
+
+def _normalize_genre(genre: str) -> str:
+    """Slow path: reduces a genre name to its lookup key (e.g. "Hip-Hop" -> "hiphop")."""
+    return genre.lower().replace("-", "").replace(" ", "")
+
+
+# Common spellings of the known genres/moods, mapped straight to their lookup keys
+_GENRE_SPELLINGS = {
+    "edm": ["EDM"],
+    "hiphop": ["Hip-Hop", "Hip Hop", "HipHop"],
+    "jazz": ["Jazz"],
+    "rock": ["Rock"],
+    "ambient": ["Ambient"]
+}
+_GENRE_ALIASES = {
+    cased: genre_key
+    for genre_key, spellings in _GENRE_SPELLINGS.items()
+    for spelling in spellings
+    for cased in (spelling, spelling.lower(), spelling.upper(), spelling.title())
+}
+_MOOD_ALIASES = {
+    cased: mood_key
+    for mood_key in PromptBuilder.MOOD_GUIDELINES
+    for cased in (mood_key, mood_key.upper(), mood_key.title())
+}
+
+
+# Output example, serialized once. Values wrapped in @...@ are emitted
+# unquoted (numeric placeholders).
+_OUTPUT_SKELETON = {
+    "metadata": {
+        "tempo": "@<60-200>@",
+        "bars": "@<bars>@",
+        "time_signature": [4, 4],
+        "key": "<C-B with #/b>",
+        "scale": "major/minor"
+    },
+    "tracks": [
+        {
+            "name": "drums",
+            "instrument": "drums",
+            "midi_program": 0,
+            "notes": [{"pitch": "@<0-127>@", "start_time": "@<0-bars*4>@", "duration": "@<float>@", "velocity": "@<0-127>@"}]
+        },
+        {"name": "bass", "instrument": "<bass>", "midi_program": "@<32-39>@", "notes": "@[...]@"},
+        {"name": "melody", "instrument": "<instrument>", "midi_program": "@<int>@", "notes": "@[...]@"}
+    ]
+}
+_OUTPUT_TEMPLATE = (
+    json.dumps(_OUTPUT_SKELETON, separators=(",", ":"))
+    .replace('"@', "")
+    .replace('@"', "")
+    .replace(',"tracks"', ',\n"tracks"', 1)
+)
+
+
+# Instructions shared by every request. Sent first and byte-identical across
+# calls so the prompt has a stable prefix; everything that depends on the
+# request goes after it.
+_STATIC_PREFIX = string.Template("""Compose a music loop as JSON for the REQUEST at the end.
+
+TRACKS (3-4)
+1. drums (program 0): 8+ notes/bar; 36=Kick 38=Snare 42=HH 49=Crash
+2. bass (32-39): 2+ notes/bar, chord roots
+3. melody (0-7/24-31/80-87): 4+ notes/bar, chord tones
+4. chords (0-7/48-55): optional
+
+HARMONY
+- ii-V-I (Dm7→G7→Cmaj7 in C); secondary dominants V/V (D7→G7), V/vi (E7→Am)
+- Bass outlines chord roots, changes every 2-4 bars
+- Melody: chord tones (1,3,5,7) + passing tones
+
+RULES
+- Spread notes over all bars (start_time 0 to bars*4 quarter notes)
+- Harmony changes every 2-4 bars
+- Grid: quarter/eighth/sixteenth notes
+- Pick key; scale major (uplifting) or minor (melancholic)
+- Velocity 0-127 for dynamics
+- Musically coherent, genre-appropriate
+
+OUTPUT (JSON only)
+$output_example
+""").substitute(output_example=_OUTPUT_TEMPLATE)
+
+
+def _render_bars_block(bars: int) -> str:
+    """Formats the length and note-count line, which depends only on bars."""
+    return _BARS_TEMPLATE.substitute(
+        bars=bars,
+        max_quarter_notes=bars * 4,
+        drum_notes=bars * 8,
+        bass_notes=bars * 2,
+        melody_notes=bars * 4
+    )
+
+
+# Bars is limited to 4-16 by the request model, so every line can be prebuilt
+_BARS_BLOCKS = {bars: _render_bars_block(bars) for bars in range(4, 17)}
+
+
+def iter_request_fragments(genre: str, mood: str, tempo: Optional[int], bars: int) -> Iterator[str]:
+    """
+    Yields the request-specific part of the prompt piece by piece.
+
+    Only the header lines are formatted per call; the genre, mood and bars
+    sections are the prebuilt module-level strings.
+
+    Args:
+        genre: Music genre (e.g., EDM, Jazz, Hip-Hop)
+        mood: Music mood (e.g., Happy, Sad, Energetic)
+        tempo: Optional specific tempo (BPM). If None, AI selects based on genre
+        bars: Number of bars to generate (4, 8, or 16)
+
+    Yields:
+        Consecutive prompt fragments
+    """
+    # Normalize genre/mood for lookup
+    genre_key = _GENRE_ALIASES.get(genre) or _normalize_genre(genre)
+    mood_key = _MOOD_ALIASES.get(mood) or mood.lower()
+
+    # Get genre/mood-specific sections
+    genre_info = PromptBuilder.GENRE_GUIDELINES.get(genre_key, _DEFAULT_GENRE_INFO)
+
+    # Build tempo instruction
+    if tempo:
+        tempo_instruction = f"exactly {tempo} BPM"
+    else:
+        tempo_instruction = f"pick {genre_info.tempo_range} BPM"
+
+    yield _REQUEST_TEMPLATE.substitute(
+        bars=bars, genre=genre, mood=mood, tempo_instruction=tempo_instruction
     )
+    yield _BARS_BLOCKS.get(bars) or _render_bars_block(bars)
+    yield _GENRE_BLOCKS.get(genre_key, _DEFAULT_GENRE_BLOCK)
+    yield _MOOD_BLOCKS.get(mood_key, _DEFAULT_MOOD_BLOCK)
+
+
+def iter_prompt_fragments(genre: str, mood: str, tempo: Optional[int], bars: int) -> Iterator[str]:
+    """
+    Yields the full generation prompt piece by piece: the static prefix, then the request.
+
+    Args:
+        genre: Music genre (e.g., EDM, Jazz, Hip-Hop)
+        mood: Music mood (e.g., Happy, Sad, Energetic)
+        tempo: Optional specific tempo (BPM). If None, AI selects based on genre
+        bars: Number of bars to generate (4, 8, or 16)
+
+    Yields:
+        Consecutive prompt fragments
+    """
+    yield _STATIC_PREFIX
+    yield "\n"
+    yield from iter_request_fragments(genre, mood, tempo, bars)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    """Loads the tokenizer once, or returns None if tiktoken is missing or the load fails."""
+    if tiktoken is None:
+        return None
+    try:
+        # The first load may download the BPE file
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception:
+        return None  # e.g. offline without a cached BPE file; use the estimate
+
+
+def _count_tokens(text: str) -> int:
+    """Counts tokens with tiktoken, or estimates them from the length without it."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+
+@functools.lru_cache(maxsize=1)
+def _static_prefix_tokens() -> int:
+    """Token count of _STATIC_PREFIX, encoded once."""
+    return _count_tokens(_STATIC_PREFIX)
+
+
+@functools.lru_cache(maxsize=512)
+def estimated_tokens(genre: str, mood: str, tempo: Optional[int], bars: int) -> int:
+    """
+    Estimates the prompt size of build_music_generation_messages() in tokens.
+
+    The static prefix is encoded once; only the request part is encoded per
+    new set of inputs. Chat formatting overhead is not included.
+
+    Args:
+        genre: Music genre (e.g., EDM, Jazz, Hip-Hop)
+        mood: Music mood (e.g., Happy, Sad, Energetic)
+        tempo: Optional specific tempo (BPM)
+        bars: Number of bars to generate (4, 8, or 16)
+
+    Returns:
+        Estimated number of prompt tokens
+    """
+    return _static_prefix_tokens() + _count_tokens(_build_request_cached(genre, mood, tempo, bars))
+
+
+@functools.lru_cache(maxsize=512)
+def _build_request_cached(genre: str, mood: str, tempo: Optional[int], bars: int) -> str:
+    """Builds the request-specific part of the prompt; cached like the full prompt."""
+    return "".join(iter_request_fragments(genre, mood, tempo, bars))
+
+
+@functools.lru_cache(maxsize=512)
+def _build_prompt_cached(genre: str, mood: str, tempo: Optional[int], bars: int) -> str:
+    """Builds the prompt; cached since it depends only on these four values."""
+    return "".join(iter_prompt_fragments(genre, mood, tempo, bars))
 
-    print("Generated Prompt:")
-    print("=" * 80)
-    print(prompt)
-    print("=" * 80)
-    print(f"\nPrompt length: {len(prompt)} characters")
@@ -0,0 +1,26 @@
+"""
+Prints a sample generation prompt.
+
+Run from the backend directory:
+    python -m examples.demo_prompt_builder
+"""
+
+from app.utils.prompt_builder import PromptBuilder
+
+
+if __name__ == "__main__":
+    builder = PromptBuilder()
+
+    # Test prompt generation
+    prompt = builder.build_music_generation_prompt(
+        genre="EDM",
+        mood="Energetic",
+        tempo=128,
+        bars=8
+    )
+
+    print("Generated Prompt:")
+    print("=" * 80)
+    print(prompt)
+    print("=" * 80)
+    print(f"\nPrompt length: {len(prompt)} characters")
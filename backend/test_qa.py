@@ -3,58 +3,103 @@ Quality Assurance Test Suite for BeatCanvas
 Tests various scenarios and edge cases for the audio pipeline.
 """
 
+import asyncio
+import io
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import numpy as np
 from app.models import MusicSchema, MetadataSchema, TrackSchema, NoteSchema
 from app.services.midi_service import MidiService
 from app.services.audio_service import AudioService
 
-def test_scenario(name: str, music: MusicSchema, cleanup: bool = True):
-    """Test a specific scenario."""
-    print(f"\n{'='*60}")
-    print(f"Testing: {name}")
-    print(f"{'='*60}")
+def make_notes(count: int, step: float, pitch: int, duration: float, velocity: int) -> List[NoteSchema]:
+    """Build evenly spaced notes (constant test values, so validation is skipped)."""
+    starts = (np.arange(count, dtype=np.float64) * step).tolist()
+    return [
+        NoteSchema.model_construct(pitch=pitch, start_time=start, duration=duration, velocity=velocity)
+        for start in starts
+    ]
 
-    try:
-        # Generate file paths
-        midi_path = f"/tmp/test_{name.replace(' ', '_')}.mid"
-        mp3_path = f"/tmp/test_{name.replace(' ', '_')}.mp3"
 
+def test_scenario(name: str, music: MusicSchema) -> Tuple[bool, str]:
+    """Test a specific scenario, returning the result and its report."""
+    # Buffered so parallel scenarios write their reports in one piece
+    log = io.StringIO()
+    log.write(f"\n{'='*60}\n")
+    log.write(f"Testing: {name}\n")
+    log.write(f"{'='*60}\n")
+
+    try:
         # Services
         midi_service = MidiService()
         audio_service = AudioService()
 
         # Test pipeline
-        print(f"📝 Metadata: {music.metadata.tempo} BPM, {music.metadata.bars} bars, {music.metadata.key} {music.metadata.scale}")
-        print(f"🎹 Tracks: {len(music.tracks)}")
+        log.write(f"📝 Metadata: {music.metadata.tempo} BPM, {music.metadata.bars} bars, {music.metadata.key} {music.metadata.scale}\n")
+        log.write(f"🎹 Tracks: {len(music.tracks)}\n")
 
-        # MIDI conversion
-        print("  → Converting to MIDI...")
-        midi_service.convert_json_to_midi(music, midi_path)
-        print(f"  ✓ MIDI created ({os.path.getsize(midi_path)} bytes)")
+        # MIDI conversion (in memory; only the sizes are checked)
+        log.write("  → Converting to MIDI...\n")
+        midi_bytes = midi_service.convert_json_to_midi_bytes(music)
+        log.write(f"  ✓ MIDI created ({len(midi_bytes)} bytes)\n")
 
         # Audio conversion
-        print("  → Converting to MP3...")
-        audio_service.midi_to_mp3(midi_path, mp3_path)
-        mp3_size = os.path.getsize(mp3_path)
-        print(f"  ✓ MP3 created ({mp3_size} bytes, {mp3_size / 1024:.1f} KB)")
+        log.write("  → Converting to MP3...\n")
+        mp3_bytes = asyncio.run(audio_service.midi_to_mp3_bytes(midi_bytes))
+        mp3_size = len(mp3_bytes)
+        log.write(f"  ✓ MP3 created ({mp3_size} bytes, {mp3_size / 1024:.1f} KB)\n")
+
+        log.write(f"✅ {name}: PASSED\n")
+        return True, log.getvalue()
+
+    except Exception as e:
+        log.write(f"❌ {name}: FAILED - {str(e)}\n")
+        return False, log.getvalue()
+
+
+def test_buffer_pool() -> Tuple[bool, str]:
+    """Acquire and release render buffers of mixed sizes (pool bookkeeping regression)."""
+    name = "Render Buffer Pool (mixed sizes)"
+    log = io.StringIO()
+    log.write(f"\n{'='*60}\n")
+    log.write(f"Testing: {name}\n")
+    log.write(f"{'='*60}\n")
+
+    try:
+        audio_service = AudioService()
+
+        # A smaller buffer ahead of the match forces a search past the first entry
+        audio_service._release_buffer(audio_service._acquire_buffer(100))
+        audio_service._release_buffer(audio_service._acquire_buffer(1000))
+        buffer = audio_service._acquire_buffer(500)
+        assert buffer.size == 1000, f"expected the pooled 1000-sample buffer, got {buffer.size}"
+        audio_service._release_buffer(buffer)
 
-        # Cleanup
-        if cleanup:
-            os.remove(midi_path)
-            os.remove(mp3_path)
-            print("  ✓ Cleaned up temporary files")
+        # Overfill the pool so the smallest buffer has to be dropped
+        for size in [300, 200, 400, 100, 600]:
+            audio_service._release_buffer(np.empty(size, dtype=np.int16))
+        sizes = sorted(b.size for b in audio_service._buffer_pool)
+        assert sizes == [300, 400, 600, 1000], f"unexpected pool contents {sizes}"
+        log.write(f"  ✓ Pooled buffer sizes: {sizes}\n")
 
-        print(f"✅ {name}: PASSED")
-        return True
+        log.write(f"✅ {name}: PASSED\n")
+        return True, log.getvalue()
 
     except Exception as e:
-        print(f"❌ {name}: FAILED - {str(e)}")
-        return False
+        log.write(f"❌ {name}: FAILED - {str(e)}\n")
+        return False, log.getvalue()
+
+
+def test_scenario_worker(case: Tuple[str, dict]) -> Tuple[bool, str]:
+    """Run one scenario in a worker process (music is passed as a plain dict)."""
+    name, music_data = case
+    return test_scenario(name, MusicSchema.model_validate(music_data))
 
 
 def main():
-    results = []
+    cases = []
 
     # Test 1: Minimum BPM (60) with 4 bars
     metadata_1 = MetadataSchema(
@@ -64,12 +109,12 @@ def main():
         key="C",
         scale="major"
     )
-    kicks = [NoteSchema(pitch=36, start_time=float(i * 4), duration=0.25, velocity=100) for i in range(4)]
+    kicks = make_notes(4, step=4, pitch=36, duration=0.25, velocity=100)
     music_1 = MusicSchema(
         metadata=metadata_1,
         tracks=[TrackSchema(name="drums", instrument="drums", midi_program=0, notes=kicks)]
     )
-    results.append(test_scenario("Minimum BPM (60) - 4 bars", music_1))
+    cases.append(("Minimum BPM (60) - 4 bars", music_1.model_dump()))
 
     # Test 2: Maximum BPM (180) with 16 bars
     metadata_2 = MetadataSchema(
@@ -79,12 +124,12 @@ def main():
         key="A",
         scale="minor"
     )
-    kicks = [NoteSchema(pitch=36, start_time=float(i * 4), duration=0.25, velocity=100) for i in range(16)]
+    kicks = make_notes(16, step=4, pitch=36, duration=0.25, velocity=100)
     music_2 = MusicSchema(
         metadata=metadata_2,
         tracks=[TrackSchema(name="drums", instrument="drums", midi_program=0, notes=kicks)]
     )
-    results.append(test_scenario("Maximum BPM (180) - 16 bars", music_2))
+    cases.append(("Maximum BPM (180) - 16 bars", music_2.model_dump()))
 
     # Test 3: Multiple instruments (drums + bass + melody)
     metadata_3 = MetadataSchema(
@@ -96,28 +141,22 @@ def main():
     )
 
     # Drums
-    drum_notes = [
-        NoteSchema(pitch=36, start_time=float(i), duration=0.25, velocity=100)  # Kick every beat
-        for i in range(0, 32, 1)
-    ]
+    drum_notes = make_notes(32, step=1, pitch=36, duration=0.25, velocity=100)  # Kick every beat
     drums = TrackSchema(name="drums", instrument="drums", midi_program=0, notes=drum_notes)
 
     # Bass (play root note pattern)
-    bass_notes = [
-        NoteSchema(pitch=43, start_time=float(i), duration=0.5, velocity=80)  # G2
-        for i in range(0, 32, 2)
-    ]
+    bass_notes = make_notes(16, step=2, pitch=43, duration=0.5, velocity=80)  # G2
     bass = TrackSchema(name="bass", instrument="electric_bass", midi_program=33, notes=bass_notes)
 
     # Melody (simple ascending pattern)
     melody_notes = [
-        NoteSchema(pitch=67 + (i % 8), start_time=float(i * 2), duration=1.0, velocity=70)  # G4-D5
+        NoteSchema.model_construct(pitch=67 + (i % 8), start_time=float(i * 2), duration=1.0, velocity=70)  # G4-D5
         for i in range(16)
     ]
     melody = TrackSchema(name="lead", instrument="synth_lead", midi_program=80, notes=melody_notes)
 
     music_3 = MusicSchema(metadata=metadata_3, tracks=[drums, bass, melody])
-    results.append(test_scenario("Multiple Instruments (Drums + Bass + Melody)", music_3))
+    cases.append(("Multiple Instruments (Drums + Bass + Melody)", music_3.model_dump()))
 
     # Test 4: Edge case - Very low velocity
     metadata_4 = MetadataSchema(
@@ -127,15 +166,12 @@ def main():
         key="C",
         scale="major"
     )
-    soft_notes = [
-        NoteSchema(pitch=60, start_time=float(i), duration=0.5, velocity=10)
-        for i in range(16)
-    ]
+    soft_notes = make_notes(16, step=1, pitch=60, duration=0.5, velocity=10)
     music_4 = MusicSchema(
         metadata=metadata_4,
         tracks=[TrackSchema(name="soft_piano", instrument="piano", midi_program=0, notes=soft_notes)]
     )
-    results.append(test_scenario("Edge Case - Very Low Velocity (10)", music_4))
+    cases.append(("Edge Case - Very Low Velocity (10)", music_4.model_dump()))
 
     # Test 5: Edge case - Very high pitch
     metadata_5 = MetadataSchema(
@@ -145,15 +181,12 @@ def main():
         key="C",
         scale="major"
     )
-    high_notes = [
-        NoteSchema(pitch=120, start_time=float(i), duration=0.5, velocity=80)
-        for i in range(16)
-    ]
+    high_notes = make_notes(16, step=1, pitch=120, duration=0.5, velocity=80)
     music_5 = MusicSchema(
         metadata=metadata_5,
         tracks=[TrackSchema(name="high_notes", instrument="flute", midi_program=73, notes=high_notes)]
     )
-    results.append(test_scenario("Edge Case - Very High Pitch (120)", music_5))
+    cases.append(("Edge Case - Very High Pitch (120)", music_5.model_dump()))
 
     # Test 6: Standard BPM (128) with 8 bars (most common use case)
     metadata_6 = MetadataSchema(
@@ -163,15 +196,24 @@ def main():
         key="E",
         scale="minor"
     )
-    standard_notes = [
-        NoteSchema(pitch=36, start_time=float(i * 2), duration=0.25, velocity=100)
-        for i in range(16)
-    ]
+    standard_notes = make_notes(16, step=2, pitch=36, duration=0.25, velocity=100)
     music_6 = MusicSchema(
         metadata=metadata_6,
         tracks=[TrackSchema(name="drums", instrument="drums", midi_program=0, notes=standard_notes)]
     )
-    results.append(test_scenario("Standard Use Case (128 BPM - 8 bars)", music_6))
+    cases.append(("Standard Use Case (128 BPM - 8 bars)", music_6.model_dump()))
+
+    # Scenarios are independent (own services and file paths), so run them in parallel;
+    # map() keeps the results in scenario order for the summary
+    with ProcessPoolExecutor(max_workers=min(len(cases), os.cpu_count() or 1)) as executor:
+        outcomes = list(executor.map(test_scenario_worker, cases))
+
+    outcomes.append(test_buffer_pool())
+
+    results = []
+    for passed, log in outcomes:
+        sys.stdout.write(log)
+        results.append(passed)
 
     # Summary
     print(f"\n{'='*60}")